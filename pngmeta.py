@@ -1,7 +1,58 @@
 import os
+import errno
 import json
+import math
+import operator
 import re
-from PIL import Image
+import shlex
+import sys
+import struct
+import zlib
+import argparse
+import time
+import sqlite3
+from array import array
+from bisect import bisect_left
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+try:
+    import numpy
+except ImportError:  # ParamColumns filters with plain loops over the arrays instead
+    numpy = None
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+TEXT_CHUNKS = (b'tEXt', b'zTXt', b'iTXt')
+
+# Index files with these extensions are SQLite databases; anything else is JSON
+SQLITE_EXTS = ('.sqlite', '.sqlite3', '.db')
+
+# Changes since the last full save are appended here; load_index replays them
+JOURNAL_SUFFIX = '.journal'
+# Fold the journal into the index once it has this many lines (or a quarter of the index)
+JOURNAL_COMPACT_MIN = 10000
+
+# A1111 settings line: 'Key: value' pairs separated by commas, values optionally JSON-quoted
+A1111_SETTING = re.compile(r'\s*(\w[\w \-/]+):\s*("(?:\\.|[^\\"])+"|[^,]*)(?:,|$)')
+# Settings that get a typed field of their own; the rest are kept as strings under "settings"
+A1111_FIELDS = {
+    "Steps": ("steps", int),
+    "Sampler": ("sampler", str),
+    "CFG scale": ("cfg_scale", float),
+    "Seed": ("seed", int),
+    "Model hash": ("model_hash", str),
+    "Model": ("model", str),
+}
+
+# Typed fields that can be filtered on; numeric ones are float columns with NaN for missing values
+NUMERIC_PARAMS = ('steps', 'cfg_scale', 'seed', 'width', 'height')
+TEXT_PARAMS = ('sampler', 'model', 'model_hash')
+PARAM_ALIASES = {'cfg': 'cfg_scale', 'hash': 'model_hash'}
+# A tag on more than 1/BITMAP_DENSITY of the images is kept as a bitmap (n/8
+# bytes) rather than a sorted ID array (4 bytes per image), the same
+# break-even roaring bitmaps use to pick a container
+BITMAP_DENSITY = 32
+
+FILTER_OPS = {'>=': operator.ge, '<=': operator.le, '>': operator.gt, '<': operator.lt, '=': operator.eq}
 
 def parse_generation_parameters(parameters):
     # Simplified parsing logic
@@ -12,63 +63,871 @@ def parse_generation_parameters(parameters):
             metadata[key.strip()] = value.strip()
     return metadata
 
-def get_image_metadata(image_path):
-    with Image.open(image_path) as img:
-        info = img.info
-        if "parameters" in info:
-            metadata = parse_generation_parameters(info["parameters"])
-            return metadata
-        else:
+def _unquote(value):
+    if not value.startswith('"'):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+def parse_a1111_parameters(parameters):
+    # Split A1111 'parameters' text into the prompt, the negative prompt and
+    # typed settings. The last line holds the settings when it has at least
+    # three 'Key: value' pairs (the same test the webui uses); the prompts may
+    # span several lines.
+    lines = parameters.strip().split('\n')
+    settings_line = ''
+    if len(A1111_SETTING.findall(lines[-1])) >= 3:
+        settings_line = lines.pop()
+    prompt_lines = []
+    negative_lines = []
+    target = prompt_lines
+    for line in lines:
+        if line.startswith('Negative prompt:'):
+            target = negative_lines
+            line = line[len('Negative prompt:'):]
+        target.append(line)
+    params = {"prompt": '\n'.join(prompt_lines).strip(), "negative_prompt": '\n'.join(negative_lines).strip()}
+    settings = {}
+    for key, value in A1111_SETTING.findall(settings_line):
+        key = key.strip()
+        value = _unquote(value.strip())
+        try:
+            if key == "Size":
+                width, height = value.split('x')
+                params["width"], params["height"] = int(width), int(height)
+            elif key in A1111_FIELDS:
+                field, cast = A1111_FIELDS[key]
+                params[field] = cast(value)
+            else:
+                settings[key] = value
+        except ValueError:
+            settings[key] = value  # Malformed; kept as text rather than dropped
+    params["settings"] = settings
+    return params
+
+def _decode_text_chunk(chunk_type, data):
+    # Returns (keyword, text) for a tEXt/zTXt/iTXt chunk body
+    keyword, _, rest = data.partition(b'\0')
+    if chunk_type == b'tEXt':
+        text = rest.decode('latin-1')
+    elif chunk_type == b'zTXt':
+        text = zlib.decompress(rest[1:]).decode('latin-1')
+    else:
+        compressed = rest[0]
+        _, _, rest = rest[2:].partition(b'\0')  # Language tag
+        _, _, rest = rest.partition(b'\0')  # Translated keyword
+        text = (zlib.decompress(rest) if compressed else rest).decode('utf-8')
+    return keyword.decode('latin-1'), text
+
+def read_png_text(image_path, read_size=65536):
+    # Walk the chunk list and collect the text chunks, stopping at the first IDAT.
+    # One read normally covers every chunk before the pixel data; anything
+    # further away is reached with a seek instead of reading through it.
+    text = {}
+    with open(image_path, 'rb') as f:
+        buffer = f.read(read_size)
+        if buffer[:8] != PNG_SIGNATURE:
             return None
+        offset = 0  # File position of buffer[0]
 
-def build_index(directory):
-    index = {}
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith('.png'):
-                file_path = os.path.join(root, file)
-                metadata = get_image_metadata(file_path)
-                if metadata:
-                    first_key = next(iter(metadata))
-                    first_value = metadata[first_key]
+        def span(start, length):
+            nonlocal buffer, offset
+            if start < offset or start + length > offset + len(buffer):
+                f.seek(start)
+                buffer = f.read(max(length, read_size))
+                offset = start
+            return buffer[start - offset:start - offset + length]
+
+        position = 8
+        while True:
+            header = span(position, 8)
+            if len(header) < 8:
+                break
+            length, chunk_type = struct.unpack('>I4s', header)
+            if chunk_type in (b'IDAT', b'IEND'):
+                break
+            if chunk_type in TEXT_CHUNKS:
+                data = span(position + 8, length)
+                if len(data) < length:
+                    break  # Truncated file
+                try:
+                    keyword, value = _decode_text_chunk(chunk_type, data)
+                except (zlib.error, UnicodeDecodeError, IndexError):
+                    pass  # Skip a corrupt chunk like Pillow does
+                else:
+                    text[keyword] = value
+            position += 12 + length  # Length, type, data, CRC
+    return text
+
+def get_image_metadata(image_path):
+    text = read_png_text(image_path)
+    if text and "parameters" in text:
+        metadata = parse_generation_parameters(text["parameters"])
+        return metadata
+    else:
+        return None
+
+def scan_pngs(directory):
+    # Yield (path, stat) for every PNG under directory; DirEntry.stat is free on Windows
+    stack = [directory]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith('.png'):
                     try:
-                        lora, tags = first_value.split('>', 1)
-                        words_list = tags.strip().split(', ')
-                        index[file_path] = {
-                            "lora": lora.strip(),
-                            "tags": words_list,
-                        }
-                    except ValueError:
-                        print(f"Skipping file {file_path}: metadata format not as expected.")
-    return index
+                        yield entry.path, entry.stat()
+                    except OSError:
+                        pass
+
+def index_entry(file_path, stat):
+    # Files without usable parameters are kept (with no tags) so they aren't re-parsed every update
+    entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "lora": None, "tags": [], "params": {}}
+    text = read_png_text(file_path)
+    if text and "parameters" in text:
+        entry["params"] = parse_a1111_parameters(text["parameters"])
+        metadata = parse_generation_parameters(text["parameters"])
+        if metadata:
+            first_key = next(iter(metadata))
+            first_value = metadata[first_key]
+            try:
+                lora, tags = first_value.split('>', 1)
+                entry["lora"] = lora.strip()
+                entry["tags"] = tags.strip().split(', ')
+            except ValueError:
+                print(f"Skipping file {file_path}: metadata format not as expected.")
+    return entry
+
+def _parse_or_skip(file_path, stat):
+    try:
+        return index_entry(file_path, stat)
+    except OSError as e:
+        # Unreadable right now (locked, share hiccup); left out so the next update retries it
+        print(f"Skipping file {file_path}: {e}")
+        return None
+
+def parse_files(items, workers=1, executor="thread"):
+    # Yield (path, entry) for each (path, stat) in items, in completion order.
+    # items is consumed lazily, so parsing overlaps the directory walk; at most
+    # a few files per worker are queued ahead. Threads suit local disks and
+    # network shares (reads release the GIL); processes only help when
+    # decompressing zTXt/iTXt chunks dominates.
+    if workers <= 1:
+        for file_path, stat in items:
+            entry = _parse_or_skip(file_path, stat)
+            if entry is not None:
+                yield file_path, entry
+        return
+
+    pool_cls = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+    with pool_cls(max_workers=workers) as pool:
+        running = {}
+        items = iter(items)
+        while True:
+            for file_path, stat in items:
+                running[pool.submit(_parse_or_skip, file_path, stat)] = file_path
+                if len(running) >= 4 * workers:
+                    break
+            if not running:
+                return
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                file_path = running.pop(future)
+                entry = future.result()
+                if entry is not None:
+                    yield file_path, entry
+
+def build_index(directory, workers=1, executor="thread"):
+    # Results arrive in completion order; sorting the paths keeps the index deterministic
+    entries = dict(parse_files(scan_pngs(directory), workers, executor))
+    return {file_path: entries[file_path] for file_path in sorted(entries)}
+
+def is_sqlite_index(index_file):
+    return index_file.lower().endswith(SQLITE_EXTS)
+
+def update_index(directory, index_file, workers=1, executor="thread"):
+    # Re-parse only new or changed PNGs (by size and mtime), drop deleted ones,
+    # and persist just those changes: appended to the journal for JSON, or
+    # applied in one transaction for SQLite. Returns (index, changes); index is
+    # None for SQLite, which is queried in place with SqliteIndex.
+    if is_sqlite_index(index_file):
+        sqlite_index = SqliteIndex(index_file)
+        known = sqlite_index.file_stats()
+    else:
+        index = load_index(index_file) if os.path.exists(index_file) else {}
+        # Entries written before typed parameters were indexed have no "params" and are re-parsed
+        known = {file_path: (entry.get("size"), entry.get("mtime_ns")) if "params" in entry else None
+                 for file_path, entry in index.items()}
+    seen = set()
+
+    def changed_files():
+        for file_path, stat in scan_pngs(directory):
+            seen.add(file_path)
+            if known.get(file_path) != (stat.st_size, stat.st_mtime_ns):
+                yield file_path, stat
+
+    parsed = dict(parse_files(changed_files(), workers, executor))
+    changes = [(file_path, parsed[file_path]) for file_path in sorted(parsed)]
+    changes += [(file_path, None) for file_path in known if file_path not in seen]
+
+    if is_sqlite_index(index_file):
+        with sqlite_index:
+            sqlite_index.apply(changes)
+        return None, len(changes)
+
+    for file_path, entry in changes:
+        if entry is None:
+            del index[file_path]
+        else:
+            index[file_path] = entry
+    if not os.path.exists(index_file):
+        save_index(index, index_file)
+    elif changes:
+        journal_file = index_file + JOURNAL_SUFFIX
+        with open(journal_file, 'a') as f:
+            for file_path, entry in changes:
+                f.write(json.dumps({"path": file_path, "entry": entry}) + '\n')
+        with open(journal_file, 'r') as f:
+            journal_lines = sum(1 for _ in f)
+        if journal_lines >= max(JOURNAL_COMPACT_MIN, len(index) // 4):
+            save_index(index, index_file)
+    return index, len(changes)
 
 def save_index(index, output_file):
-    with open(output_file, 'w') as f:
-        json.dump(index, f, indent=4)
+    # Full rewrite; the journal is folded in, so it is removed afterwards
+    tmp_file = output_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    if is_sqlite_index(output_file):
+        with SqliteIndex(tmp_file) as sqlite_index:
+            sqlite_index.apply(index.items())
+    else:
+        with open(tmp_file, 'w') as f:
+            json.dump(index, f, indent=4)
+    os.replace(tmp_file, output_file)
+    if os.path.exists(output_file + JOURNAL_SUFFIX):
+        os.remove(output_file + JOURNAL_SUFFIX)
 
 def load_index(index_file):
+    if is_sqlite_index(index_file):
+        # Connecting would create an empty database; fail like a missing JSON index does
+        if not os.path.exists(index_file):
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), index_file)
+        # Loads everything; use SqliteIndex directly for lookups and queries
+        with SqliteIndex(index_file) as sqlite_index:
+            return dict(sqlite_index.entries())
     with open(index_file, 'r') as f:
-        return json.load(f)
+        index = json.load(f)
+    # Replay changes appended by update_index; a truncated last line is ignored
+    if os.path.exists(index_file + JOURNAL_SUFFIX):
+        with open(index_file + JOURNAL_SUFFIX, 'r') as f:
+            for line in f:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    continue
+                if change["entry"] is None:
+                    index.pop(change["path"], None)
+                else:
+                    index[change["path"]] = change["entry"]
+    return index
 
 def search_index(index, tags):
     # Use regular expression to split by comma followed by any number of spaces or newline characters
     tags_set = set(re.split(r',\s*', tags))
-    result = [file_path for file_path, words_list in index.items() if tags_set.issubset(words_list)]
+    result = [file_path for file_path, entry in index.items() if tags_set.issubset(entry["tags"])]
     return result
 
-# Build and save the index
-directory = "D:\\SteamLibrary\\steamapps\\common\\TMP\\txt2img-images\\txt2img-images"
-index = build_index(directory)
-
-# Ensure the output file is in the express folder
-express_folder = os.path.dirname(os.path.abspath(__file__))
-output_file = os.path.join(express_folder, "image_index.json")
-save_index(index, output_file)
-
-# Load the index and perform a search
-index = load_index(output_file)
-search_tags = "denim"
-results = search_index(index, search_tags)
-print(f"Images with tags '{search_tags}':")
-for result in results:
-    print(result)
\ No newline at end of file
+def parse_query(expression):
+    # Split a query into (required, excluded) clauses, each a list of alternative terms
+    required = []
+    excluded = []
+    for clause in re.split(r',\s*', expression.strip()):
+        clause = clause.strip()
+        if not clause:
+            continue
+        negated = clause.startswith('-') or clause.upper().startswith('NOT ')
+        if negated:
+            clause = clause[1:] if clause.startswith('-') else clause[4:]
+        terms = [term.strip() for term in clause.split('|') if term.strip()]
+        if terms:  # A bare '-' or '|' names nothing, so it doesn't constrain the query
+            (excluded if negated else required).append(terms)
+    return required, excluded
+
+def _contains(posting, image_id):
+    position = bisect_left(posting, image_id)
+    return position < len(posting) and posting[position] == image_id
+
+def _filter(candidates, posting, keep):
+    # Keep (or drop) the candidates that are in posting. A short candidate list
+    # probes the posting by binary search; otherwise set operations do it in C.
+    if len(candidates) * 16 < len(posting):
+        return [image_id for image_id in candidates if _contains(posting, image_id) == keep]
+    if keep:
+        return sorted(set(candidates).intersection(posting))
+    return sorted(set(candidates).difference(posting))
+
+def _union(postings):
+    if len(postings) == 1:
+        return postings[0]
+    return array('I', sorted(set().union(*postings)))
+
+def _to_bitmap(ids, size):
+    # Bitmap of size bits (a Python int) with the bits of ids set
+    if numpy is not None:
+        bits = numpy.zeros(size, dtype=bool)
+        bits[numpy.asarray(ids, dtype=numpy.intp)] = True
+        return int.from_bytes(numpy.packbits(bits, bitorder='little').tobytes(), 'little')
+    data = bytearray((size + 7) // 8)
+    for image_id in ids:
+        data[image_id >> 3] |= 1 << (image_id & 7)
+    return int.from_bytes(data, 'little')
+
+# The set bit positions of every byte value, for decoding bitmaps without NumPy
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+def _bitmap_ids(bitmap, size):
+    # Sorted IDs of the set bits of bitmap
+    data = bitmap.to_bytes((size + 7) // 8, 'little')
+    if numpy is not None:
+        return numpy.flatnonzero(numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8), bitorder='little')).tolist()
+    ids = []
+    for position, byte in enumerate(data):
+        if byte:
+            base = position << 3
+            ids.extend(base + bit for bit in _BYTE_BITS[byte])
+    return ids
+
+def _popcount(bitmap):
+    if hasattr(bitmap, 'bit_count'):  # Python 3.10+
+        return bitmap.bit_count()
+    return bin(bitmap).count('1')
+
+def parse_filter(expression):
+    # Split a settings filter into (field, op, value) conditions. Conditions
+    # are separated by spaces and all must match; quote values with spaces:
+    #     'cfg:5..7 steps:>=30 width:832 model:"sd_xl_base_1.0"'
+    # Numeric fields take a value, '>=', '<=', '>', '<' or an inclusive
+    # 'low..high' range (either end may be left open); text fields match exactly.
+    conditions = []
+    for token in shlex.split(expression):
+        field, separator, value = token.partition(':')
+        field = PARAM_ALIASES.get(field.lower(), field.lower())
+        if not separator or field not in NUMERIC_PARAMS + TEXT_PARAMS:
+            raise ValueError(f"Unknown filter '{token}'; fields are {', '.join(NUMERIC_PARAMS + TEXT_PARAMS)}")
+        if field in TEXT_PARAMS:
+            conditions.append((field, '=', value))
+        elif '..' in value:
+            low, high = value.split('..', 1)
+            if low:
+                conditions.append((field, '>=', float(low)))
+            if high:
+                conditions.append((field, '<=', float(high)))
+        else:
+            op = next((op for op in FILTER_OPS if value.startswith(op)), '=')
+            conditions.append((field, op, float(value[len(op):] if value.startswith(op) else value)))
+    return conditions
+
+class ParamColumns:
+    # The typed generation settings of an index dict as columns: one float
+    # array per numeric field (NaN where missing) and one array of codes into
+    # a value table per text field (-1 where missing). Row i is the i-th
+    # sorted path, the same IDs TagIndex uses. Filters compare whole columns
+    # with NumPy when it is installed, and loop over the arrays otherwise.
+
+    def __init__(self, index):
+        self.paths = sorted(index)
+        self.columns = {field: array('d') for field in NUMERIC_PARAMS}
+        self.columns.update({field: array('i') for field in TEXT_PARAMS})
+        self.codes = {field: {} for field in TEXT_PARAMS}
+        for file_path in self.paths:
+            params = index[file_path].get("params") or {}
+            for field in NUMERIC_PARAMS:
+                value = params.get(field)
+                self.columns[field].append(math.nan if value is None else value)
+            for field in TEXT_PARAMS:
+                value = params.get(field)
+                codes = self.codes[field]
+                self.columns[field].append(-1 if value is None else codes.setdefault(value, len(codes)))
+        if numpy is not None:
+            # Zero-copy views; the arrays are never resized after this
+            self.columns = {field: numpy.frombuffer(column, dtype=numpy.float64 if column.typecode == 'd' else numpy.intc)
+                            for field, column in self.columns.items()}
+
+    def values(self, field):
+        # Distinct values of a text field, e.g. to list the models in the library
+        return list(self.codes[field])
+
+    def query(self, expression):
+        # Return the sorted IDs of the images whose settings match expression
+        conditions = []
+        for field, op, value in parse_filter(expression):
+            if field in TEXT_PARAMS:
+                value = self.codes[field].get(value, -2)  # -2 matches nothing, not even missing values
+            conditions.append((self.columns[field], FILTER_OPS[op], value))
+        if numpy is not None:
+            mask = numpy.ones(len(self.paths), dtype=bool)
+            for column, compare, value in conditions:
+                mask &= compare(column, value)
+            return numpy.flatnonzero(mask).tolist()
+        ids = range(len(self.paths))
+        for column, compare, value in conditions:
+            ids = [image_id for image_id in ids if compare(column[image_id], value)]
+        return list(ids)
+
+    def count(self, expression):
+        return len(self.query(expression))
+
+    def search(self, expression):
+        return [self.paths[image_id] for image_id in self.query(expression)]
+
+class TagIndex:
+    # Inverted index over an index dict. Tags and LoRA names are interned to
+    # integer IDs, and the images of each (an image ID is a position in the
+    # sorted paths) are stored like a roaring bitmap container: a sorted array
+    # of image IDs while the term is rare, and a bitmap (a Python int with bit
+    # i set for image i) once it is on more than 1/BITMAP_DENSITY of the
+    # images. Clauses over common tags are then ANDed, ORed and negated as
+    # whole integers, and counting them is a popcount.
+    #
+    # Queries are comma-separated clauses that must all match (like
+    # search_index). A clause can be a tag, alternatives joined with '|',
+    # 'lora:<name>', or a negation written '-tag' or 'NOT tag':
+    #     "denim jacket, 1girl | 1boy, lora:denimStyle, -lowres"
+    # where narrows the result with a parse_filter settings filter.
+    #
+    # Nothing refers back to the index dict, so dropping it after building
+    # frees the per-file tag lists and prompts.
+
+    def __init__(self, index):
+        self.paths = sorted(index)
+        self.tag_ids = {}
+        self.lora_ids = {}
+        members = []
+        for image_id, file_path in enumerate(self.paths):
+            entry = index[file_path]
+            term_ids = {self._intern(self.tag_ids, tag.strip(), members) for tag in entry["tags"]}
+            if entry["lora"]:
+                # '<lora:name:weight>' is stored as 'name:weight'; filter by name
+                term_ids.add(self._intern(self.lora_ids, entry["lora"].split(':')[0], members))
+            for term_id in term_ids:
+                members[term_id].append(image_id)
+        self.counts = array('I', map(len, members))
+        self.sets = [_to_bitmap(ids, len(self.paths)) if len(ids) * BITMAP_DENSITY > len(self.paths) else array('I', ids)
+                     for ids in members]
+        self.all = (1 << len(self.paths)) - 1
+        # Only the typed settings columns are kept from the per-file params
+        self.params = ParamColumns(index)
+
+    @staticmethod
+    def _intern(term_ids, term, members):
+        term_id = term_ids.get(term)
+        if term_id is None:
+            term_id = term_ids[term] = len(members)
+            members.append([])
+        return term_id
+
+    def _members(self, term):
+        if term.lower().startswith('lora:'):
+            term_id = self.lora_ids.get(term[5:].strip())
+        else:
+            term_id = self.tag_ids.get(term)
+        return array('I') if term_id is None else self.sets[term_id]
+
+    def _size(self, members):
+        return _popcount(members) if isinstance(members, int) else len(members)
+
+    def _bits(self, members):
+        return members if isinstance(members, int) else _to_bitmap(members, len(self.paths))
+
+    def _clause(self, terms):
+        sets = [self._members(term) for term in terms]
+        if not any(isinstance(members, int) for members in sets):
+            return _union(sets)
+        bits = 0
+        for members in sets:
+            bits |= self._bits(members)
+        return bits
+
+    def _filter(self, candidates, members, keep):
+        if not isinstance(members, int):
+            return _filter(candidates, members, keep)
+        data = members.to_bytes((len(self.paths) + 7) // 8, 'little')
+        return [image_id for image_id in candidates if (data[image_id >> 3] >> (image_id & 7) & 1) == keep]
+
+    def _evaluate(self, expression, where=None):
+        # The matching images, as a bitmap when every required clause is one
+        # and as a sorted ID sequence otherwise
+        required_terms, excluded_terms = parse_query(expression)
+        required = sorted((self._clause(terms) for terms in required_terms), key=self._size)
+        excluded = [self._clause(terms) for terms in excluded_terms]
+
+        if not required or isinstance(required[0], int):
+            bits = self.all
+            for members in required:
+                bits &= self._bits(members)
+            for members in excluded:
+                bits &= ~self._bits(members)
+            if where:
+                bits &= _to_bitmap(self.params.query(where), len(self.paths))
+            return bits
+
+        # Intersect the shortest ID arrays first so the candidates shrink fastest
+        candidates = required[0]
+        for members in required[1:]:
+            if not candidates:
+                break
+            candidates = self._filter(candidates, members, keep=True)
+        for members in excluded:
+            candidates = self._filter(candidates, members, keep=False)
+        if where:
+            candidates = _filter(candidates, self.params.query(where), keep=True)
+        return candidates
+
+    def query(self, expression, where=None):
+        # Return the sorted IDs of the images matching expression
+        result = self._evaluate(expression, where)
+        return _bitmap_ids(result, len(self.paths)) if isinstance(result, int) else list(result)
+
+    def count(self, expression, where=None):
+        return self._size(self._evaluate(expression, where))
+
+    def search(self, expression, where=None):
+        return [self.paths[image_id] for image_id in self.query(expression, where)]
+
+    def tag_counts(self, expression=None, where=None):
+        # Images per tag, or per tag among the images matching expression/where
+        if expression is None and where is None:
+            return {tag: self.counts[term_id] for tag, term_id in self.tag_ids.items()}
+        result = self._bits(self._evaluate(expression or '', where))
+        data = result.to_bytes((len(self.paths) + 7) // 8, 'little')
+        if numpy is not None:
+            matched = numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8), bitorder='little').view(bool)
+        counts = {}
+        for tag, term_id in self.tag_ids.items():
+            members = self.sets[term_id]
+            if isinstance(members, int):
+                count = _popcount(members & result)
+            elif numpy is not None:
+                count = int(numpy.count_nonzero(matched[numpy.frombuffer(members, dtype=numpy.uint32)]))
+            else:
+                count = sum(data[image_id >> 3] >> (image_id & 7) & 1 for image_id in members)
+            if count:
+                counts[tag] = count
+        return counts
+
+def _deep_size(obj, seen):
+    # sys.getsizeof of obj and everything it holds, counting shared objects once
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(key, seen) + _deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_deep_size(item, seen) for item in obj)
+    return size
+
+def tag_memory_report(index, tag_index):
+    # Bytes spent on tags and LoRA names: as the per-file lists of strings in
+    # the index dict versus the interned dictionary plus arrays and bitmaps
+    before_seen = set()
+    before = sum(_deep_size(entry["tags"], before_seen) + _deep_size(entry["lora"], before_seen) for entry in index.values())
+    after_seen = set()
+    after = (_deep_size(tag_index.tag_ids, after_seen) + _deep_size(tag_index.lora_ids, after_seen)
+             + _deep_size(tag_index.sets, after_seen) + _deep_size(tag_index.counts, after_seen))
+    bitmaps = sum(1 for members in tag_index.sets if isinstance(members, int))
+    return {
+        "images": len(index),
+        "terms": len(tag_index.sets),
+        "bitmaps": bitmaps,
+        "arrays": len(tag_index.sets) - bitmaps,
+        "before_bytes": before,
+        "after_bytes": after,
+    }
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER,
+    mtime_ns INTEGER,
+    lora TEXT,
+    lora_name TEXT,
+    prompt TEXT,
+    negative_prompt TEXT,
+    steps INTEGER,
+    sampler TEXT,
+    cfg_scale REAL,
+    seed INTEGER,
+    width INTEGER,
+    height INTEGER,
+    model_hash TEXT,
+    model TEXT,
+    settings TEXT
+);
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY,
+    tag TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS image_tags (
+    image_id INTEGER NOT NULL REFERENCES images (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    tag_id INTEGER NOT NULL REFERENCES tags (id),
+    PRIMARY KEY (image_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS image_tags_by_tag ON image_tags (tag_id, image_id);
+CREATE INDEX IF NOT EXISTS images_by_lora ON images (lora_name);
+"""
+
+# Typed parameter columns of the images table, added to databases created before them
+SQLITE_PARAM_COLUMNS = (
+    ('prompt', 'TEXT'), ('negative_prompt', 'TEXT'), ('steps', 'INTEGER'), ('sampler', 'TEXT'),
+    ('cfg_scale', 'REAL'), ('seed', 'INTEGER'), ('width', 'INTEGER'), ('height', 'INTEGER'),
+    ('model_hash', 'TEXT'), ('model', 'TEXT'), ('settings', 'TEXT'),
+)
+SQLITE_PARAM_INDEXES = """
+CREATE INDEX IF NOT EXISTS images_by_model ON images (model);
+CREATE INDEX IF NOT EXISTS images_by_steps ON images (steps);
+CREATE INDEX IF NOT EXISTS images_by_cfg_scale ON images (cfg_scale);
+CREATE INDEX IF NOT EXISTS images_by_size ON images (width, height);
+"""
+
+class SqliteIndex:
+    # The index as a SQLite database. Opening it reads nothing up front; point
+    # lookups go through the path index and tag queries (same syntax as
+    # TagIndex) through the (tag_id, image_id) index, so startup time and
+    # memory don't grow with the library.
+
+    def __init__(self, index_file):
+        self.connection = sqlite3.connect(index_file)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SQLITE_SCHEMA)
+        self._add_param_columns()
+        self.connection.executescript(SQLITE_PARAM_INDEXES)
+        self._tag_ids = None
+
+    def _add_param_columns(self):
+        existing = {name for _, name, *_ in self.connection.execute('PRAGMA table_info(images)')}
+        missing = [(name, sql_type) for name, sql_type in SQLITE_PARAM_COLUMNS if name not in existing]
+        if missing:
+            with self.connection:
+                for name, sql_type in missing:
+                    self.connection.execute(f'ALTER TABLE images ADD COLUMN {name} {sql_type}')
+                # Clearing the stats makes the next update re-parse the rows written without them
+                self.connection.execute('UPDATE images SET size = NULL, mtime_ns = NULL')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    def file_stats(self):
+        return {path: (size, mtime_ns) for path, size, mtime_ns in self.connection.execute('SELECT path, size, mtime_ns FROM images')}
+
+    def _tag_id(self, tag):
+        if self._tag_ids is None:
+            self._tag_ids = dict(self.connection.execute('SELECT tag, id FROM tags'))
+        tag_id = self._tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = self.connection.execute('INSERT INTO tags (tag) VALUES (?)', (tag,)).lastrowid
+            self._tag_ids[tag] = tag_id
+        return tag_id
+
+    def apply(self, changes):
+        # Write (path, entry) pairs in one transaction; an entry of None deletes the path
+        with self.connection:
+            for file_path, entry in changes:
+                self.connection.execute('DELETE FROM images WHERE path = ?', (file_path,))
+                if entry is None:
+                    continue
+                lora_name = entry["lora"].split(':')[0] if entry["lora"] else None
+                params = dict(entry.get("params") or {})
+                if "settings" in params:
+                    params["settings"] = json.dumps(params["settings"])
+                columns = ['path', 'size', 'mtime_ns', 'lora', 'lora_name'] + [name for name, _ in SQLITE_PARAM_COLUMNS]
+                values = [file_path, entry.get("size"), entry.get("mtime_ns"), entry["lora"], lora_name]
+                values += [params.get(name) for name, _ in SQLITE_PARAM_COLUMNS]
+                image_id = self.connection.execute(
+                    f'INSERT INTO images ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})', values,
+                ).lastrowid
+                self.connection.executemany(
+                    'INSERT INTO image_tags (image_id, position, tag_id) VALUES (?, ?, ?)',
+                    [(image_id, position, self._tag_id(tag.strip())) for position, tag in enumerate(entry["tags"])],
+                )
+
+    def _entry(self, image_id, size, mtime_ns, lora, *param_values):
+        tags = [tag for tag, in self.connection.execute(
+            'SELECT tags.tag FROM image_tags JOIN tags ON tags.id = image_tags.tag_id '
+            'WHERE image_tags.image_id = ? ORDER BY image_tags.position', (image_id,))]
+        params = {name: value for (name, _), value in zip(SQLITE_PARAM_COLUMNS, param_values) if value is not None}
+        if "settings" in params:
+            params["settings"] = json.loads(params["settings"])
+        return {"size": size, "mtime_ns": mtime_ns, "lora": lora, "tags": tags, "params": params}
+
+    def _entry_columns(self):
+        return 'id, size, mtime_ns, lora, ' + ', '.join(name for name, _ in SQLITE_PARAM_COLUMNS)
+
+    def get(self, file_path):
+        row = self.connection.execute(f'SELECT {self._entry_columns()} FROM images WHERE path = ?', (file_path,)).fetchone()
+        return self._entry(*row) if row else None
+
+    def entries(self):
+        rows = self.connection.execute(f'SELECT path, {self._entry_columns()} FROM images ORDER BY path').fetchall()
+        for file_path, *row in rows:
+            yield file_path, self._entry(*row)
+
+    def _split_terms(self, terms):
+        tags = [term for term in terms if not term.lower().startswith('lora:')]
+        loras = [term[5:].strip() for term in terms if term.lower().startswith('lora:')]
+        return tags, loras
+
+    def _estimate(self, terms):
+        # Upper bound on a clause's matches, read off the indexes
+        tags, loras = self._split_terms(terms)
+        estimate = 0
+        if tags:
+            estimate += self.connection.execute(
+                f'SELECT COUNT(*) FROM image_tags WHERE tag_id IN (SELECT id FROM tags WHERE tag IN ({", ".join("?" * len(tags))}))',
+                tags).fetchone()[0]
+        if loras:
+            estimate += self.connection.execute(
+                f'SELECT COUNT(*) FROM images WHERE lora_name IN ({", ".join("?" * len(loras))})', loras).fetchone()[0]
+        return estimate
+
+    def _clause_select(self, terms):
+        # SELECT of the distinct image IDs matching any of terms
+        tags, loras = self._split_terms(terms)
+        selects = []
+        if tags:
+            selects.append('SELECT DISTINCT image_id AS id FROM image_tags WHERE tag_id IN '
+                           f'(SELECT id FROM tags WHERE tag IN ({", ".join("?" * len(tags))}))')
+        if loras:
+            selects.append(f'SELECT id FROM images WHERE lora_name IN ({", ".join("?" * len(loras))})')
+        return ' UNION '.join(selects), tags + loras
+
+    def _clause_condition(self, terms):
+        # Per-row test of whether images.id matches any of terms (one index probe per term kind)
+        tags, loras = self._split_terms(terms)
+        conditions = []
+        if tags:
+            conditions.append('EXISTS (SELECT 1 FROM image_tags WHERE image_tags.image_id = images.id AND tag_id IN '
+                              f'(SELECT id FROM tags WHERE tag IN ({", ".join("?" * len(tags))})))')
+        if loras:
+            conditions.append(f'images.lora_name IN ({", ".join("?" * len(loras))})')
+        return '(' + ' OR '.join(conditions) + ')', tags + loras
+
+    def _query_sql(self, expression, where=None):
+        # The smallest required clause drives the query; every other clause is
+        # probed per candidate through the indexes, like a shortest-first
+        # intersection. where (a parse_filter settings filter) adds column tests.
+        required, excluded = parse_query(expression)
+        required.sort(key=self._estimate)
+        if required:
+            base, params = self._clause_select(required[0])
+            sql = f'SELECT images.id, images.path FROM ({base}) AS base CROSS JOIN images ON images.id = base.id'
+        else:
+            sql, params = 'SELECT images.id, images.path FROM images', []
+        conditions = []
+        for negate, clauses in ((False, required[1:]), (True, excluded)):
+            for terms in clauses:
+                condition, condition_params = self._clause_condition(terms)
+                conditions.append(('NOT ' if negate else '') + condition)
+                params += condition_params
+        for field, op, value in parse_filter(where or ''):
+            conditions.append(f'images.{field} {op} ?')
+            params.append(value)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        return sql, params
+
+    def count(self, expression, where=None):
+        sql, params = self._query_sql(expression, where)
+        return self.connection.execute(f'SELECT COUNT(*) FROM ({sql})', params).fetchone()[0]
+
+    def search(self, expression, where=None):
+        sql, params = self._query_sql(expression, where)
+        return [path for _, path in self.connection.execute(f'{sql} ORDER BY images.path', params)]
+
+if __name__ == "__main__":
+    # Ensure the output file is in the express folder
+    express_folder = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description="Index the generation parameters of PNGs and search them by tag.")
+    parser.add_argument("directory", nargs="?", type=str,
+                        default="D:\\SteamLibrary\\steamapps\\common\\TMP\\txt2img-images\\txt2img-images",
+                        help="The txt2img output directory to index.")
+    parser.add_argument("--output", type=str, default=os.path.join(express_folder, "image_index.json"),
+                        help="Where to save the index (default: image_index.json next to this script). "
+                             f"A {', '.join(SQLITE_EXTS)} extension stores it as a SQLite database that is queried without loading it.")
+    parser.add_argument("--search", type=str, default="denim",
+                        help="Comma-separated tags that must all match; 'a | b' for either, '-tag' or 'NOT tag' to exclude, 'lora:<name>' to filter by LoRA.")
+    parser.add_argument("--where", type=str, default=None,
+                        help="Also filter by generation settings, e.g. 'cfg:5..7 steps:>=30 width:832 model:\"sd_xl_base_1.0\"'. "
+                             f"Fields: {', '.join(NUMERIC_PARAMS + TEXT_PARAMS)}.")
+    parser.add_argument("--count", action="store_true", help="Print only the number of matching images.")
+    parser.add_argument("--memory", action="store_true",
+                        help="Print the bytes per image spent on tags as per-file string lists versus interned IDs and bitmaps.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of PNGs to read and parse concurrently. 1 (default) reads one at a time; use 16-64 threads on network shares.")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread",
+                        help="Pool type used when --workers > 1: thread (default, best for I/O-bound reads) or process.")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Re-parse every PNG and rewrite the index instead of updating only new, changed and deleted files.")
+    args = parser.parse_args()
+    if args.where:
+        try:
+            parse_filter(args.where)
+        except ValueError as e:
+            parser.error(f"--where: {e}")
+
+    # Build and save the index, or bring an existing one up to date
+    if args.rebuild or not os.path.exists(args.output):
+        index = build_index(args.directory, workers=args.workers, executor=args.executor)
+        save_index(index, args.output)
+    else:
+        index, changes = update_index(args.directory, args.output, workers=args.workers, executor=args.executor)
+        print(f"Index updated: {changes} changed entries.")
+
+    # Perform a search; for JSON, TagIndex replaces the index dict
+    if is_sqlite_index(args.output):
+        tag_index = SqliteIndex(args.output)
+    else:
+        tag_index = TagIndex(index)
+    if args.memory:
+        if index is None:
+            index = load_index(args.output)
+        report = tag_memory_report(index, tag_index if isinstance(tag_index, TagIndex) else TagIndex(index))
+        per_image = max(report["images"], 1)
+        print(f"Tag memory for {report['images']} images ({report['terms']} tags and LoRAs: "
+              f"{report['bitmaps']} bitmaps, {report['arrays']} ID arrays):")
+        print(f"  per-file lists: {report['before_bytes']} bytes ({report['before_bytes'] / per_image:.1f} bytes/image)")
+        print(f"  interned:       {report['after_bytes']} bytes ({report['after_bytes'] / per_image:.1f} bytes/image)")
+    # TagIndex holds everything a search needs; dropping the dict frees the per-file tag lists
+    del index
+
+    search_tags = args.search
+    description = f"tags '{search_tags}'" + (f" and settings '{args.where}'" if args.where else "")
+    start = time.perf_counter()
+    if args.count:
+        count = tag_index.count(search_tags, args.where)
+        print(f"{count} images with {description} ({(time.perf_counter() - start) * 1000:.1f} ms)")
+    else:
+        results = tag_index.search(search_tags, args.where)
+        print(f"Images with {description}:")
+        for result in results:
+            print(result)
\ No newline at end of file
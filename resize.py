@@ -2,7 +2,31 @@ from __future__ import annotations
 
 import os
 import argparse
-import uuid
+import shutil
+import json
+import hashlib
+import re
+import io
+import queue
+import threading
+import collections
+import contextlib
+import functools
+import platform
+import signal
+import struct
+import tarfile
+import time
+import zipfile
+import multiprocessing
+import multiprocessing.connection
+from dataclasses import dataclass
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+try:
+    import resource
+except ImportError:  # Windows: --file_memory is not enforced
+    resource = None
 
 Image = None
 ImageColor = None
@@ -63,8 +87,50 @@ Examples
   3) Make square thumbnails with transparent padding (best with .png/.webp)
       python resize.py "C:\\images" --box 512 512 --box_mode contain --pad_color transparent --target_ext .png
 
-  4) Flip only
+  4) Use all cores on a large batch (progress printed as files finish)
+      python resize.py "C:\\images" --workers 8 --progress_order completion
+
+  5) Fast thumbnails from camera-sized JPEGs (reduced-resolution decode)
+      python resize.py "C:\\images" --max_dimension 1024 --fast_decode --quality 90
+
+  6) Only process new or changed files since the last run (resumable)
+      python resize.py "C:\\images" --incremental --rename
+
+  7) Gallery ladder: 4 sizes x 2 formats from a single decode per image
+      python resize.py "C:\\images" --sizes 256 512 1024 2048 --formats .jpg .webp
+
+  8) Streaming pipeline for a network share (prefetch reads, batched writes)
+      python resize.py "\\\\server\\share\\images" --pipeline --workers 8 --readers 4 --read_ahead 32 --write_batch 32
+
+  9) Copy files that are already 512x512 PNGs instead of re-encoding them
+      python resize.py "C:\\images" --box 512 512 --target_ext .png --copy_through
+
+  10) Process byte-identical duplicates once and hardlink the rest
+      python resize.py "C:\\images" --dedupe link --rename
+
+  11) Flip only
       python resize.py "C:\\images" --flip_horizontal
+
+  12) Augment in one pass: resized original plus its horizontal mirror from a single decode
+      python resize.py "C:\\images" --box 512 512 --box_mode cover --flip_horizontal --emit_original
+
+  13) Preview the work (no-op / downscale / upscale / box-crop) without writing anything
+      python resize.py "C:\\images" --box 512 512 --box_mode cover --plan
+
+  14) Dataset export: 512px JPEGs streamed into 256 MB tar shards
+      python resize.py "C:\\images" --box 512 512 --box_mode cover --shards tar --shard_size 256 --workers 8
+
+  15) Find where a slow batch spends its time (JSON report plus merged cProfile stats)
+      python resize.py "C:\\images" --target_ext .webp --workers 4 --profile profile.json --profile_cprofile resize.prof
+
+  16) Keep running and resize each new generation (in any dated subfolder) as it is written
+      python resize.py "C:\\outputs" --output_dir "C:\\outputs-512" --box 512 512 --box_mode contain --watch --workers 2
+
+  17) Give each file 30 s and 2 GB; quarantine (and skip on later runs) anything that exceeds it or crashes
+      python resize.py "C:\\images" --workers 8 --file_timeout 30 --file_memory 2048
+
+  18) PNG outputs, then losslessly squeeze them on 8 cores with up to 5 CPU seconds each
+      python resize.py "C:\\images" --target_ext .png --workers 8 --optimize --optimize_budget 5
 """
 
 
@@ -76,6 +142,8 @@ Notes
      - clip: no scaling; crops/pads to reach the box size
      - cover: scales up/down to fully fill the box, then crops
      - contain: scales up/down to fit inside the box, then pads
+  --flip_horizontal/--flip_vertical alone run the flip-only pass; add --chain
+  (or --emit_original) to flip inside the resize pass instead.
 
 Dependencies
 
@@ -83,32 +151,195 @@ Dependencies
      pip install pillow
   Optional (enables more formats):
      pip install pillow-avif-plugin pillow-heif
+  Optional (--watch uses inotify instead of polling on Linux):
+     pip install inotify_simple
 """
 
-def generate_unique_guid(output_dir, target_ext):
-    """Generate a unique GUID filename that doesn't exist in the output directory."""
-    while True:
-        guid_filename = str(uuid.uuid4()) + target_ext
-        guid_path = os.path.join(output_dir, guid_filename)
-        if not os.path.exists(guid_path):
-            return guid_filename
-
-def batch_rename_files(output_dir, target_ext):
-    """Rename all files in the output directory to use the folder name as prefix with numbered suffixes."""
-    # Get the folder name
-    folder_name = os.path.basename(output_dir)
-    
-    # Get all files with the target extension
-    files = [f for f in os.listdir(output_dir) if f.lower().endswith(target_ext.lower())]
-    files.sort()  # Sort for consistent ordering
-    
-    # Rename files with (1), (2), (3) format
-    for idx, filename in enumerate(files, start=1):
-        old_path = os.path.join(output_dir, filename)
-        new_filename = f"{folder_name} ({idx}){target_ext}"
-        new_path = os.path.join(output_dir, new_filename)
-        os.rename(old_path, new_path)
-        print(f"Renamed: {filename} -> {new_filename}")
+def _sequence_number(filename, output_dir):
+    """Return N if filename's stem is '<output folder name> (N)', else None."""
+    folder_name = os.path.basename(os.path.normpath(output_dir))
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    match = re.fullmatch(re.escape(folder_name) + r" \((\d+)\)", stem, flags=re.IGNORECASE)
+    return int(match.group(1)) if match else None
+
+
+def _next_sequence_number(output_dir, subfolders=()):
+    """Return the first unused N after the highest existing '<folder name> (N)' output.
+
+    One directory listing per folder; --sizes outputs live in subfolders.
+    """
+    numbers = [0]
+    for folder in (output_dir, *(os.path.join(output_dir, sub) for sub in subfolders)):
+        if os.path.isdir(folder):
+            numbers.extend(n for n in (_sequence_number(f, output_dir) for f in os.listdir(folder)) if n is not None)
+    return max(numbers) + 1
+
+
+def _write_atomically(path, write):
+    """Call write(tmp_path), then rename the temp file over path.
+
+    A crash or error never leaves a partial file under the final name.
+    """
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Input extensions picked up from dir_path
+INPUT_EXTS = (".jpg", ".png", ".jpeg", ".webp", ".avif", ".heic")
+
+MANIFEST_FILENAME = ".resize-manifest.jsonl"
+
+# Options that change the bytes written for an input. Any change re-processes it.
+FINGERPRINT_KEYS = ("min_dimension", "max_dimension", "box", "box_mode", "pad_color", "target_ext",
+                    "fast_decode", "reducing_gap", "quality", "sizes", "formats", "copy_through",
+                    "flip_horizontal", "flip_vertical", "emit_original")
+
+
+def _params_fingerprint(options):
+    """Return a short stable hash of the resize parameters that affect output."""
+    params = {key: options[key] for key in FINGERPRINT_KEYS}
+    encoded = json.dumps(params, sort_keys=True, default=list).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def _file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_manifest(output_dir):
+    """Load the processing manifest as {input filename: latest record}.
+
+    The manifest is append-only JSON lines so a crashed run keeps every
+    record written before the crash; later lines win. A truncated last
+    line is ignored.
+    """
+    manifest = {}
+    path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return manifest
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            manifest[record["input"]] = record
+    return manifest
+
+
+def _write_manifest(output_dir, manifest):
+    """Rewrite the manifest with one line per input (compacts appended updates)."""
+    path = os.path.join(output_dir, MANIFEST_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in manifest.values():
+            f.write(json.dumps(record) + "\n")
+    os.replace(tmp_path, path)
+
+
+CONTENT_STORE_FILENAME = ".resize-content-store.json"
+
+
+def _load_content_store(output_dir):
+    """Load the --dedupe store: {"<sha256>-<params fingerprint>": {"stem": ..., "outputs": [...]}}."""
+    path = os.path.join(output_dir, CONTENT_STORE_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_content_store(output_dir, store):
+    path = os.path.join(output_dir, CONTENT_STORE_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(store, f)
+    os.replace(tmp_path, path)
+
+
+class _DuplicateInput(Exception):
+    """A --dedupe input whose content key was already claimed, by another input or (owner "") an earlier run."""
+
+    def __init__(self, digest, owner):
+        super().__init__(digest, owner)
+        self.digest = digest
+        self.owner = owner
+
+
+def _link_or_copy(src, dst, replace=False):
+    """Hardlink dst to src, falling back to a byte copy across filesystems.
+
+    An existing dst is only replaced when `replace` says resize.py owns it;
+    anything else raises FileExistsError rather than being deleted.
+    """
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return
+        if not replace:
+            raise FileExistsError(f"'{dst}' already exists and was not written by resize.py")
+
+    def link(tmp_path):
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            _copy_file(src, tmp_path)
+
+    _write_atomically(dst, link)
+
+
+def _reuse_outputs(entry, output_path, output_dir, dedupe, owned=()):
+    """Materialize a stored entry's outputs for a duplicate input and return their paths.
+
+    Stored outputs are renamed onto the duplicate's own stem, so ladder
+    subfolders and flip suffixes carry over. Existing files are only
+    replaced if they are in `owned` (absolute paths of outputs the manifest,
+    content store or this run wrote). With dedupe="alias" nothing is written
+    and the existing outputs are returned for the manifest to point at.
+    """
+    if dedupe == "alias":
+        return [os.path.join(output_dir, relative_path) for relative_path in entry["outputs"]]
+
+    new_stem = os.path.splitext(os.path.basename(output_path))[0]
+    written = []
+    for relative_path in entry["outputs"]:
+        src = os.path.join(output_dir, relative_path)
+        folder, name = os.path.split(relative_path)
+        dst = os.path.join(output_dir, folder, new_stem + name[len(entry["stem"]):])
+        if os.path.abspath(dst) != os.path.abspath(src):
+            _link_or_copy(src, dst, replace=os.path.abspath(dst) in owned)
+        written.append(dst)
+    return written
+
+
+def _manifest_unchanged(previous, record, output_dir, img_path=None):
+    """Return True if `previous` shows the input was already processed with the same parameters.
+
+    Size and mtime are compared first. Only when they differ, and previous
+    recorded a content hash, is img_path (if given) hashed; the digest is
+    stored in record["sha256"].
+    """
+    if previous is None or previous.get("params") != record["params"]:
+        return False
+    # Sharded outputs are recorded as '<shard>#<member>'
+    if not os.path.exists(os.path.join(output_dir, previous["output"].split("#", 1)[0])):
+        return False
+    if previous["size"] == record["size"] and previous["mtime_ns"] == record["mtime_ns"]:
+        return True
+    # Touched but not modified: trust the content hash when both runs recorded one
+    if img_path is None or previous.get("sha256") is None:
+        return False
+    record["sha256"] = _file_sha256(img_path)
+    return previous["sha256"] == record["sha256"]
 
 
 def _make_canvas_for_padding(reference_img, size: tuple[int, int], pad_color: str):
@@ -138,60 +369,1686 @@ def _fit_to_box(img, box: tuple[int, int], box_mode: str, pad_color: str):
     if box_width <= 0 or box_height <= 0:
         raise ValueError("Box dimensions must be positive")
 
-    img = ImageOps.exif_transpose(img)
+    with _stage("exif_transpose"):
+        img = ImageOps.exif_transpose(img)
     box_mode = box_mode.lower().strip()
 
     if box_mode == "cover":
-        return ImageOps.fit(img, (box_width, box_height), method=Image.LANCZOS, centering=(0.5, 0.5))
+        with _stage("resize"):
+            return ImageOps.fit(img, (box_width, box_height), method=Image.LANCZOS, centering=(0.5, 0.5))
 
     if box_mode == "contain":
-        contained = ImageOps.contain(img, (box_width, box_height), method=Image.LANCZOS)
-        canvas = _make_canvas_for_padding(contained, (box_width, box_height), pad_color)
-        paste_x = (box_width - contained.size[0]) // 2
-        paste_y = (box_height - contained.size[1]) // 2
+        with _stage("resize"):
+            contained = ImageOps.contain(img, (box_width, box_height), method=Image.LANCZOS)
+        with _stage("fit"):
+            return _paste_centered(contained, (box_width, box_height), pad_color)
+
+    if box_mode == "clip":
+        with _stage("fit"):
+            width, height = img.size
+            crop_w = min(box_width, width)
+            crop_h = min(box_height, height)
+            left = (width - crop_w) // 2
+            top = (height - crop_h) // 2
+            cropped = img.crop((left, top, left + crop_w, top + crop_h))
+            return _paste_centered(cropped, (box_width, box_height), pad_color)
+
+    raise ValueError(f"Unsupported --box_mode '{box_mode}'. Use: clip, cover, contain")
+
+
+def _paste_centered(img, box, pad_color):
+    """Center img on a box-sized canvas filled with pad_color."""
+    box_width, box_height = box
+    canvas = _make_canvas_for_padding(img, (box_width, box_height), pad_color)
+    paste_x = (box_width - img.size[0]) // 2
+    paste_y = (box_height - img.size[1]) // 2
+
+    if canvas.mode == "RGBA" and img.mode != "RGBA":
+        img = img.convert("RGBA")
+
+    if "A" in img.getbands():
+        canvas.paste(img, (paste_x, paste_y), mask=img)  # Uses the alpha band without copying it
+    else:
+        canvas.paste(img, (paste_x, paste_y))
+    return canvas
+
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def _oriented_size(img):
+    """Return the (width, height) the image will have after exif_transpose, using header data only."""
+    width, height = img.size
+    try:
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    except Exception:
+        orientation = 1
+    if orientation in (5, 6, 7, 8):
+        return height, width
+    return width, height
+
+
+def _scaled_target_size(width, height, options):
+    """Return the size the image content is resampled to, or None if it is not resampled.
+
+    width/height are the oriented source dimensions. For --box this is the
+    scaled image before cropping/padding; clip mode never scales.
+    """
+    box = options["box"]
+    if box is None:
+        return _compute_minmax_size(width, height, options["min_dimension"], options["max_dimension"])
+
+    box_width, box_height = box
+    box_mode = options["box_mode"].lower().strip()
+    if box_mode == "cover":
+        scale = max(box_width / width, box_height / height)
+    elif box_mode == "contain":
+        scale = min(box_width / width, box_height / height)
+    else:
+        return None
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
 
-        if canvas.mode == "RGBA" and contained.mode != "RGBA":
-            contained = contained.convert("RGBA")
+# Modes Image.reduce() supports; palette and bilevel images keep their full decode
+REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA", "CMYK", "YCbCr", "I", "F")
 
-        if "A" in contained.getbands():
-            canvas.paste(contained, (paste_x, paste_y), mask=contained.getchannel("A"))
+
+def _reduced_decode(img, target_size, reducing_gap):
+    """Decode img at a reduced scale that still leaves `reducing_gap` times the target pixels.
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale via draft(); any remaining
+    integer factor is removed with reduce(). The caller then does the final
+    LANCZOS resample, so a larger reducing_gap trades speed for quality.
+    """
+    target_width, target_height = target_size
+    width, height = img.size
+    if (width, height) != _oriented_size(img):
+        target_width, target_height = target_height, target_width
+
+    needed = (max(1, int(target_width * reducing_gap)), max(1, int(target_height * reducing_gap)))
+    if needed[0] >= width or needed[1] >= height:
+        return img  # Not a large enough downscale to be worth it
+
+    if img.format == "JPEG":
+        img.draft(None, needed)
+
+    factor = min(img.size[0] // needed[0], img.size[1] // needed[1])
+    if factor > 1 and img.mode in REDUCIBLE_MODES:
+        img = img.reduce(factor)
+    return img
+
+
+def _compute_minmax_size(width, height, min_dimension, max_dimension):
+    """Return the (width, height) produced by the classic min/max resize rules."""
+    # First, scale up if both dimensions are less than min_dimension
+    if min_dimension is not None and width < min_dimension and height < min_dimension:
+        if width > height:
+            ratio = min_dimension / width
         else:
-            canvas.paste(contained, (paste_x, paste_y))
-        return canvas
+            ratio = min_dimension / height
+        new_width = int(width * ratio)
+        new_height = int(height * ratio)
+    else:
+        new_width, new_height = width, height
 
-    if box_mode == "clip":
-        width, height = img.size
-        crop_w = min(box_width, width)
-        crop_h = min(box_height, height)
-        left = (width - crop_w) // 2
-        top = (height - crop_h) // 2
-        cropped = img.crop((left, top, left + crop_w, top + crop_h))
-
-        canvas = _make_canvas_for_padding(cropped, (box_width, box_height), pad_color)
-        paste_x = (box_width - cropped.size[0]) // 2
-        paste_y = (box_height - cropped.size[1]) // 2
-
-        if canvas.mode == "RGBA" and cropped.mode != "RGBA":
-            cropped = cropped.convert("RGBA")
-
-        if "A" in cropped.getbands():
-            canvas.paste(cropped, (paste_x, paste_y), mask=cropped.getchannel("A"))
+    # Then, scale down if any dimension is greater than max_dimension
+    if max_dimension is not None and (new_width > max_dimension or new_height > max_dimension):
+        if new_width > new_height:
+            ratio = max_dimension / new_width
         else:
-            canvas.paste(cropped, (paste_x, paste_y))
-        return canvas
+            ratio = max_dimension / new_height
+        new_width = int(new_width * ratio)
+        new_height = int(new_height * ratio)
 
-    raise ValueError(f"Unsupported --box_mode '{box_mode}'. Use: clip, cover, contain")
+    return new_width, new_height
+
+
+def _save_image(img, path, target_ext, quality=None):
+    """Save an image in the format implied by target_ext.
+
+    quality applies to the lossy encoders (JPEG/WEBP/AVIF/HEIF); None keeps
+    the encoder default.
+    """
+    params = {} if quality is None else {"quality": quality}
+    with _stage("save", target_ext):
+        if target_ext == '.jpg':
+            img = img.convert("RGB")  # Ensure image is in RGB mode for JPEG
+            img.save(path, 'JPEG', **params)
+        elif target_ext == '.png':
+            img.save(path, 'PNG')
+        elif target_ext == '.webp':
+            img.save(path, 'WEBP', **params)
+        elif target_ext == '.avif':
+            img.save(path, 'AVIF', **params)
+        elif target_ext == '.heic':
+            img.save(path, 'HEIF', **params)
+
+
+DEFAULT_OPTIONS = {
+    "min_dimension": 1600,
+    "max_dimension": 2048,
+    "target_ext": ".jpg",
+    "box": None,
+    "box_mode": "clip",
+    "pad_color": "black",
+    "fast_decode": False,
+    "reducing_gap": 2.0,
+    "quality": None,
+    "sizes": None,
+    "formats": None,
+    "copy_through": False,
+    "flip_horizontal": False,
+    "flip_vertical": False,
+    "emit_original": False,
+}
+
+
+def _make_options(**overrides):
+    """Build the per-file options dict consumed by _process_file and friends."""
+    unknown = set(overrides) - set(DEFAULT_OPTIONS)
+    if unknown:
+        raise TypeError(f"Unknown resize options: {', '.join(sorted(unknown))}")
+    return {**DEFAULT_OPTIONS, **overrides}
+
+
+def _ladder_output_path(output_path, size, ext):
+    """Map the primary output path to its --sizes/--formats variant: <output_dir>/<size>/<stem><ext>."""
+    output_dir, filename = os.path.split(output_path)
+    return os.path.join(output_dir, str(size), os.path.splitext(filename)[0] + ext)
+
+
+def _ladder_outputs(img, rungs, output_path, options):
+    """Yield (path, image, ext) for every --sizes rung in every --formats format.
+
+    Rungs are processed largest first. A rung is resampled from the previous
+    (larger) rung instead of the full image when that rung is still at least
+    reducing_gap times its size, which keeps LANCZOS quality while touching
+    far fewer pixels.
+    """
+    previous = None
+    for size, rung_size in rungs:
+        source = img
+        if previous is not None and max(previous.size) >= options["reducing_gap"] * max(rung_size):
+            source = previous
+        with _stage("resize"):
+            resized_img = source.resize(rung_size, Image.LANCZOS)
+        for ext in options["formats"]:
+            yield from _flip_variants(resized_img, _ladder_output_path(output_path, size, ext), ext, options)
+        previous = resized_img
+
+
+# Filename suffix for the flipped variant when --emit_original also writes the unflipped one
+FLIP_SUFFIXES = {(True, False): "_fliph", (False, True): "_flipv", (True, True): "_fliphv"}
 
 
-def resize_images(dir_path, output_dir, min_dimension, max_dimension, target_ext, rename=False, box=None, box_mode="clip", pad_color="black"):
+def _flip_variants(img, path, ext, options):
+    """Yield (path, image, ext) for the flip step of the chain.
+
+    Flips run on the final-size image, so the flipped output is an exact
+    mirror of the unflipped one and costs a fraction of flipping the source.
+    With emit_original both variants come from the same decode; the flipped
+    one gets a FLIP_SUFFIXES suffix.
+    """
+    flips = (options["flip_horizontal"], options["flip_vertical"])
+    if not any(flips):
+        yield path, img, ext
+        return
+
+    flipped = img
+    with _stage("flip"):
+        if options["flip_horizontal"]:
+            flipped = flipped.transpose(Image.FLIP_LEFT_RIGHT)
+        if options["flip_vertical"]:
+            flipped = flipped.transpose(Image.FLIP_TOP_BOTTOM)
+
+    if options["emit_original"]:
+        yield path, img, ext
+        path = os.path.splitext(path)[0] + FLIP_SUFFIXES[flips] + ext
+    yield path, flipped, ext
+
+
+def _render_outputs(img, output_path, options):
+    """Yield (path, image, ext) for every output of an opened source image.
+
+    This is the single-pass transform chain: EXIF transpose, min/max resize or
+    box fit (with padding), flips, then the caller converts and saves each
+    yielded image.
+    """
+    # Work out the final size from the header before any pixels are decoded
+    oriented_size = _oriented_size(img)
+    if options["sizes"]:
+        rungs = [(size, _compute_minmax_size(*oriented_size, options["min_dimension"], size))
+                 for size in sorted(options["sizes"], reverse=True)]
+        target_size = rungs[0][1]
+    else:
+        target_size = _scaled_target_size(*oriented_size, options)
+    with _stage("decode"):
+        if options["fast_decode"] and target_size is not None:
+            img = _reduced_decode(img, target_size, options["reducing_gap"])
+        img.load()  # Decode here rather than inside whichever step touches pixels first
+
+    if options["sizes"]:
+        # Decode and transpose once, then fan out to every size and format
+        with _stage("exif_transpose"):
+            img = ImageOps.exif_transpose(img)
+        yield from _ladder_outputs(img, rungs, output_path, options)
+        return
+
+    if options["box"] is not None:
+        resized_img = _fit_to_box(img, options["box"], box_mode=options["box_mode"], pad_color=options["pad_color"])
+    else:
+        with _stage("exif_transpose"):
+            img = ImageOps.exif_transpose(img)
+        # Resize the image while maintaining aspect ratio
+        with _stage("resize"):
+            resized_img = img.resize(target_size, Image.LANCZOS)
+    yield from _flip_variants(resized_img, output_path, options["target_ext"], options)
+
+
+def _output_paths(output_path, options):
+    """Return every path _render_outputs() writes for the primary output_path, in write order."""
+    if options["sizes"]:
+        paths = [_ladder_output_path(output_path, size, ext)
+                 for size in sorted(options["sizes"], reverse=True) for ext in options["formats"]]
+    else:
+        paths = [output_path]
+    flips = (options["flip_horizontal"], options["flip_vertical"])
+    if not (options["emit_original"] and any(flips)):
+        return paths
+    flipped = []
+    for path in paths:
+        stem, ext = os.path.splitext(path)
+        flipped += [path, stem + FLIP_SUFFIXES[flips] + ext]
+    return flipped
+
+
+# Pillow format name each --target_ext is saved as
+TARGET_FORMATS = {".jpg": "JPEG", ".png": "PNG", ".webp": "WEBP", ".avif": "AVIF", ".heic": "HEIF"}
+
+# Other spellings of a TARGET_FORMATS extension
+TARGET_EXT_ALIASES = {".jpeg": ".jpg", ".heif": ".heic"}
+
+
+def _needs_no_change(img, options):
+    """Return True if re-encoding img would not change it, judged from the header alone.
+
+    That means: already in the target format, no EXIF rotation, no mode
+    conversion on save, and already at the size the transform would produce.
+    """
+    if options["sizes"] or options["flip_horizontal"] or options["flip_vertical"]:
+        return False
+    if img.format != TARGET_FORMATS.get(options["target_ext"]):
+        return False
+    if options["target_ext"] == ".jpg" and img.mode != "RGB":
+        return False
+    try:
+        if img.getexif().get(EXIF_ORIENTATION_TAG, 1) != 1:
+            return False
+    except Exception:
+        return False
+
+    if options["box"] is not None:
+        # Padding flattens alpha onto an opaque pad_color canvas, so a copy would keep pixels the transform changes
+        has_alpha = img.mode in {"RGBA", "LA"} or (img.mode == "P" and "transparency" in img.info)
+        if has_alpha and options["pad_color"].strip().lower() not in {"transparent", "none"}:
+            return False
+        return tuple(img.size) == tuple(options["box"])
+    return _compute_minmax_size(*img.size, options["min_dimension"], options["max_dimension"]) == img.size
+
+
+def _copy_file(src, dst):
+    """Copy src to dst byte for byte, kernel-side where the OS supports it.
+
+    Tries copy_file_range (Linux), then sendfile, then a plain buffered copy.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        for kernel_copy in (getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)):
+            if kernel_copy is None:
+                continue
+            offset = 0
+            try:
+                while offset < size:
+                    if kernel_copy is os.sendfile:
+                        copied = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+                    else:
+                        copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError:
+                continue  # e.g. cross-device or unsupported filesystem; try the next method
+            if offset == size:
+                return
+        fsrc.seek(0)
+        fdst.seek(0)
+        fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def _process_file(img_path, output_path, options):
+    """Resize a single image and write it to output_path.
+
+    Lives at module level so it can be pickled into process pool workers.
+    `options` is the plain dict built by resize_images. Returns the list of
+    paths written.
+    """
+    _require_pillow()
+    written = []
+    with _stage("open"):
+        img = Image.open(img_path)
+    with img:
+        if options["copy_through"] and _needs_no_change(img, options):
+            img.close()
+            with _stage("copy"):
+                _write_atomically(output_path, lambda tmp_path: _copy_file(img_path, tmp_path))
+            return [output_path]
+        try:
+            for path, resized_img, ext in _render_outputs(img, output_path, options):
+                _write_atomically(path, lambda tmp_path: _save_image(resized_img, tmp_path, ext, quality=options["quality"]))
+                written.append(path)
+        except Exception:
+            # Don't leave some of a file's outputs (ladder rungs, flip variants) behind
+            for path in written:
+                os.remove(path)
+            raise
+    return written
+
+
+def _process_bytes(data, output_path, options, source_name=None):
+    """Like _process_file, but decode from bytes and return [(path, encoded bytes, (width, height))] without writing."""
+    _require_pillow()
+    encoded = []
+    try:
+        with _stage("open"):
+            img = Image.open(io.BytesIO(data))
+    except Image.UnidentifiedImageError:
+        raise Image.UnidentifiedImageError(f"cannot identify image file {source_name!r}") from None
+    with img:
+        if options["copy_through"] and _needs_no_change(img, options):
+            return [(output_path, data, img.size)]
+        for path, resized_img, ext in _render_outputs(img, output_path, options):
+            buffer = io.BytesIO()
+            _save_image(resized_img, buffer, ext, quality=options["quality"])
+            encoded.append((path, buffer.getvalue(), resized_img.size))
+    return encoded
+
+
+def _hashed_call(encode_only, img_path, output_path, options, claims=None, fingerprint=None):
+    """Read img_path once, hash those bytes and process them; returns (sha256, result).
+
+    The result is what _encode_file (encode_only) or _process_file would
+    return. Used when the manifest records content hashes or --dedupe is
+    on, so inputs are not read a second time just to hash them.
+
+    With claims (a dict shared by every worker, a manager proxy across
+    processes), the first input with a given content hash + fingerprint
+    claims it; any other raises _DuplicateInput before decoding.
+    """
+    with _stage("read"):
+        with open(img_path, "rb") as f:
+            data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if claims is not None:
+        owner = claims.setdefault(f"{digest}-{fingerprint}", img_path)
+        if owner != img_path:
+            raise _DuplicateInput(digest, owner)
+    encoded = _process_bytes(data, output_path, options, img_path)
+    return digest, encoded if encode_only else _write_outputs(None, encoded)
+
+
+def _encode_file(img_path, output_path, options):
+    """Read img_path and return its encoded outputs like _process_bytes, for callers that write elsewhere."""
+    with open(img_path, "rb") as f:
+        data = f.read()
+    return _process_bytes(data, output_path, options, img_path)
+
+
+def _write_output_batch(batch):
+    """Write the encoded outputs of a batch of jobs; the default pipeline sink.
+
+    batch is [(job, encoded)]. Every temp file is written first, then all of
+    them are renamed into place together and each output folder is fsynced
+    once, so a batch costs one directory sync per folder instead of
+    per-file metadata round trips. Returns the written paths, or the
+    exception, for each job in order; a failed job leaves none of its
+    outputs behind.
+    """
+    results = []
+    staged = []
+    for job, encoded in batch:
+        tmp_paths = []
+        try:
+            for path, payload, _ in encoded:
+                tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+                tmp_paths.append(tmp_path)
+                _write_bytes(tmp_path, payload)
+        except Exception as e:
+            for tmp_path in tmp_paths:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            results.append(e)
+            continue
+        results.append(None)
+        staged.append((len(results) - 1, [(tmp_path, path) for tmp_path, (path, _, _) in zip(tmp_paths, encoded)]))
+
+    folders = set()
+    for position, renames in staged:
+        written = []
+        try:
+            for tmp_path, path in renames:
+                os.replace(tmp_path, path)
+                written.append(path)
+        except Exception as e:
+            for path in written:
+                os.remove(path)
+            for tmp_path, _ in renames[len(written):]:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            results[position] = e
+            continue
+        results[position] = written
+        folders.update(os.path.dirname(os.path.abspath(path)) for path in written)
+    for folder in folders:
+        _fsync_directory(folder)
+    return results
+
+
+def _fsync_directory(path):
+    """Make renames in a folder durable; a no-op where folders can't be opened (Windows)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _next_shard_number(output_dir, prefix, kind):
+    """Return the number after the highest existing '<prefix>-NNNNNN.<kind>' shard."""
+    pattern = re.escape(prefix) + r"-(\d+)\." + re.escape(kind)
+    numbers = [int(match.group(1)) for match in (re.fullmatch(pattern, f) for f in os.listdir(output_dir)) if match]
+    return max(numbers, default=-1) + 1
+
+
+class _ShardWriter:
+    """Stream encoded outputs into size-capped tar or zip shards (WebDataset layout).
+
+    Each input becomes one sample: its images plus a '<key>.json' sidecar
+    with the source name and output dimensions. Ladder rungs become
+    '<key>.<size><ext>' so a sample's files share a key. A sample never spans
+    two shards. Closing a shard writes '<prefix>-NNNNNN.index.json' with the
+    byte offset and size of every member and the members of every sample.
+    Members are stored uncompressed (the images already are), so offsets can
+    be read directly.
+
+    Re-running over an output_dir that already has shards (--incremental)
+    appends new shards. Keys that an earlier shard already holds are removed
+    from it on close(), rewriting each affected shard once, so every key
+    stays unique across the dataset.
+    """
+
+    def __init__(self, output_dir, kind="tar", max_bytes=1 << 30, prefix="shard"):
+        if kind not in ("tar", "zip"):
+            raise ValueError(f"Unsupported shard format '{kind}'. Use: tar, zip")
+        self.output_dir = output_dir
+        self.kind = kind
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.number = _next_shard_number(output_dir, prefix, kind)
+        self.archive = None
+        self.members = {}
+        self.samples = {}
+        self.size = 0
+        # Shard number holding each key written by an earlier run, and the
+        # keys re-written by this run per earlier shard (removed on close)
+        self.existing = {}
+        self.superseded = collections.defaultdict(list)
+        for number in range(self.number):
+            index = self._read_index(number)
+            for key in index.get("samples", {}) if index else ():
+                self.existing[key] = number
+
+    @property
+    def shard_name(self):
+        return f"{self.prefix}-{self.number:06d}.{self.kind}"
+
+    def _index_path(self, number):
+        return os.path.join(self.output_dir, f"{self.prefix}-{number:06d}.index.json")
+
+    def _read_index(self, number):
+        try:
+            with open(self._index_path(number), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _open_archive(self, path):
+        if self.kind == "tar":
+            return tarfile.open(path, "w", format=tarfile.PAX_FORMAT)
+        return zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED)
+
+    def _open(self):
+        self.archive = self._open_archive(os.path.join(self.output_dir, self.shard_name))
+        self.members = {}
+        self.samples = {}
+        self.size = 0
+
+    def _close_shard(self):
+        self.archive.close()
+        with open(self._index_path(self.number), "w", encoding="utf-8") as f:
+            json.dump({"shard": self.shard_name, "members": self.members, "samples": self.samples}, f)
+        self.archive = None
+        self.number += 1
+
+    def _write_member(self, archive, name, payload):
+        """Append one stored member to archive; returns (offset of its data, archive size after it)."""
+        if self.kind == "tar":
+            info = tarfile.TarInfo(name)
+            info.size = len(payload)
+            info.mtime = int(time.time())
+            archive.addfile(info, io.BytesIO(payload))
+            offset = archive.offset - (len(payload) + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+            return offset, archive.offset
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        archive.writestr(info, payload)
+        # Data follows the 30-byte local header, the name and the header's own
+        # extra field, which can differ from info.extra (e.g. a zip64 record)
+        end = archive.fp.tell()
+        archive.fp.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack("<HH", archive.fp.read(4))
+        archive.fp.seek(end)
+        return info.header_offset + 30 + name_length + extra_length, end
+
+    def _add_member(self, name, payload):
+        offset, self.size = self._write_member(self.archive, name, payload)
+        self.members[name] = {"offset": offset, "size": len(payload)}
+
+    def _remove_samples(self, number, keys):
+        """Rewrite earlier shard `number` once, without the members of the samples in keys."""
+        index = self._read_index(number)
+        if index is None:
+            return
+        removed = {name for key in keys for name in index["samples"].pop(key, ())}
+        path = os.path.join(self.output_dir, index["shard"])
+        if not index["samples"]:
+            os.remove(path)
+            os.remove(self._index_path(number))
+            return
+        members = {}
+        tmp_path = path + ".tmp"
+        with open(path, "rb") as source:
+            archive = self._open_archive(tmp_path)
+            try:
+                for name, member in sorted(index["members"].items(), key=lambda item: item[1]["offset"]):
+                    if name in removed:
+                        continue
+                    source.seek(member["offset"])
+                    offset, _ = self._write_member(archive, name, source.read(member["size"]))
+                    members[name] = {"offset": offset, "size": member["size"]}
+            finally:
+                archive.close()
+        os.replace(tmp_path, path)
+        index["members"] = members
+        with open(self._index_path(number), "w", encoding="utf-8") as f:
+            json.dump(index, f)
+
+    def _member_name(self, path):
+        folder, name = os.path.split(os.path.relpath(path, self.output_dir))
+        if not folder:
+            return name
+        stem, ext = os.path.splitext(name)
+        return f"{stem}.{folder.replace(os.sep, '.')}{ext}"
+
+    def add(self, source_name, encoded):
+        """Add one input's encoded outputs; returns '<output_dir>/<shard>#<member>' for each image."""
+        key = os.path.splitext(os.path.basename(encoded[0][0]))[0]
+        members = [(self._member_name(path), payload) for path, payload, _ in encoded]
+        sidecar = {
+            "source": source_name,
+            "outputs": {name: list(size) for (name, _), (_, _, size) in zip(members, encoded)},
+        }
+        members.append((f"{key}.json", json.dumps(sidecar).encode("utf-8")))
+
+        if key in self.existing:
+            self.superseded[self.existing.pop(key)].append(key)
+        sample_bytes = sum(len(payload) for _, payload in members)
+        if self.archive is not None and self.members and self.size + sample_bytes > self.max_bytes:
+            self._close_shard()
+        if self.archive is None:
+            self._open()
+        for name, payload in members:
+            self._add_member(name, payload)
+        self.samples[key] = [name for name, _ in members]
+        return [os.path.join(self.output_dir, f"{self.shard_name}#{name}") for name, _ in members[:-1]]
+
+    def close(self):
+        """Close the open shard, then drop superseded samples with one rewrite per earlier shard."""
+        if self.archive is not None:
+            self._close_shard()
+        while self.superseded:
+            number, keys = self.superseded.popitem()
+            self._remove_samples(number, keys)
+
+
+# zlib strategies tried for PNG, most often best first (zlib's Z_DEFAULT_STRATEGY, Z_FILTERED, Z_RLE, Z_HUFFMAN_ONLY)
+PNG_STRATEGIES = (0, 1, 3, 2)
+
+OPTIMIZABLE_EXTS = (".png", ".webp")
+
+
+def _reduced_png_image(img):
+    """Return a lossless smaller representation of img (palette, grayscale, no alpha) or None.
+
+    Pillow writes palette images with 1/2/4-bit samples when the palette is
+    small enough, so palette reduction also covers bit-depth reduction.
+    Every candidate is checked pixel-for-pixel against img.
+    """
+    reduced = img
+    if reduced.mode in ("RGBA", "LA") and reduced.getchannel("A").getextrema() == (255, 255):
+        reduced = reduced.convert(reduced.mode[:-1])
+    if reduced.mode == "RGB":
+        red, green, blue = (band.tobytes() for band in reduced.split())
+        if red == green == blue:
+            reduced = reduced.convert("L")
+
+    colors = reduced.getcolors(256) if reduced.mode in ("RGB", "RGBA", "L", "LA") else None
+    if colors is not None:
+        if reduced.mode in ("RGBA", "LA"):
+            palette = reduced.convert("RGBA").quantize(colors=len(colors), method=Image.Quantize.FASTOCTREE)
+        else:
+            palette = reduced.convert("P", palette=Image.Palette.ADAPTIVE, colors=len(colors))
+        if palette.convert(reduced.mode).tobytes() == reduced.tobytes():
+            reduced = palette
+
+    return None if reduced is img else reduced
+
+
+def _png_candidates(img):
+    """Yield (image, save params) for lossless PNG encodings of img, most promising first."""
+    reduced = _reduced_png_image(img)
+    for candidate in (reduced, img) if reduced is not None else (img,):
+        for strategy in PNG_STRATEGIES:
+            yield candidate, {"compress_level": 9, "compress_type": strategy}
+
+
+def _webp_candidates(img):
+    """Yield (image, save params) for lossless WebP encodings of img's exact pixels."""
+    yield img, {"lossless": True, "quality": 100, "method": 6, "exact": True}
+
+
+def _optimize_output(path, links, settings):
+    """Re-encode one PNG/WebP output losslessly and keep the smallest encoding; returns (old bytes, new bytes).
+
+    Candidates are tried until settings["budget"] seconds of this thread's
+    CPU time are spent (at least one is always tried). The winner is
+    decoded again and must match the current pixels exactly, otherwise the
+    file is left alone. links are every known path of a hardlinked file
+    (--dedupe link); each is atomically replaced by a link to the new file.
+    A file with links outside that list is skipped, since they could not be
+    replaced.
+    """
+    _require_pillow()
+    if os.stat(path).st_nlink > len(links):
+        size = os.path.getsize(path)
+        return size, size
+    with open(path, "rb") as f:
+        data = f.read()
+    best = data
+    started = time.thread_time()
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        ext = os.path.splitext(path)[1].lower()
+        candidates = _png_candidates(img) if ext == ".png" else _webp_candidates(img)
+        for candidate, params in candidates:
+            buffer = io.BytesIO()
+            candidate.save(buffer, TARGET_FORMATS[ext], **params)
+            if buffer.tell() < len(best):
+                best = buffer.getvalue()
+            if time.thread_time() - started >= settings["budget"]:
+                break
+        if best is not data:
+            compare_mode = "RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB"
+            with Image.open(io.BytesIO(best)) as optimized:
+                if optimized.convert(compare_mode).tobytes() != img.convert(compare_mode).tobytes():
+                    best = data
+
+    if best is not data:
+        _write_atomically(path, lambda tmp_path: _write_bytes(tmp_path, best))
+        for link in links:
+            if link != path:
+                _write_atomically(link, lambda tmp_path: os.link(path, tmp_path))
+    return len(data), len(best)
+
+
+def _optimize_outputs(paths, budget, workers=1, executor="process"):
+    """Run _optimize_output over every PNG/WebP in paths on the worker pool and print the bytes saved."""
+    links = {}  # (st_dev, st_ino) -> paths; hardlinked duplicates are the same file
+    for path in paths:
+        if not path.lower().endswith(OPTIMIZABLE_EXTS):
+            continue
+        stat = os.stat(path)
+        same_file = links.setdefault((stat.st_dev, stat.st_ino), [])
+        if path not in same_file:
+            same_file.append(path)
+    jobs = [(same_file[0], same_file[0], tuple(same_file)) for same_file in links.values()]
+    if not jobs:
+        return
+
+    print(f"Optimizing {len(jobs)} PNG/WebP outputs...")
+    before = after = 0
+    for job, sizes, error in _run_jobs(jobs, _optimize_output, {"budget": budget}, workers=workers, executor=executor):
+        if error is not None:
+            print(f"Failed to optimize {job[0]}: {error}")
+            continue
+        before += sizes[0]
+        after += sizes[1]
+        if sizes[1] < sizes[0]:
+            print(f"Optimized {job[0]}: {sizes[0]} -> {sizes[1]} bytes")
+    saved = before - after
+    print(f"Optimization saved {saved} bytes ({saved / before * 100 if before else 0:.1f}% of {before}).")
+
+
+# Bytes Pillow allocates per pixel for each mode (RGB is stored padded to 4 bytes)
+BYTES_PER_PIXEL = {"1": 1, "L": 1, "P": 1, "LA": 2, "La": 2, "PA": 2, "I;16": 2, "I;16B": 2, "I;16L": 2}
+
+
+def _estimate_memory(img, options):
+    """Estimate the peak bytes needed to process an opened image, from its header only.
+
+    Counts the decoded source (reduced if fast_decode will shrink it), one
+    full-size working copy (EXIF transpose / resample intermediate), and the
+    outputs: box modes allocate a canvas plus RGBA copies for the paste, the
+    ladder holds one image per rung and flips add a mirrored copy.
+    """
+    width, height = _oriented_size(img)
+    source_pixels = width * height
+    if options["sizes"]:
+        rung_sizes = [_compute_minmax_size(width, height, options["min_dimension"], size) for size in options["sizes"]]
+        target_size = max(rung_sizes)
+        output_pixels = sum(w * h for w, h in rung_sizes)
+    else:
+        target_size = _scaled_target_size(width, height, options)
+        box = options["box"]
+        output_pixels = box[0] * box[1] * 3 if box is not None else (target_size[0] * target_size[1])
+
+    if options["fast_decode"] and target_size is not None:
+        # draft()/reduce() leave less than 2x the reducing_gap target per side
+        reduced = (2 * options["reducing_gap"]) ** 2 * target_size[0] * target_size[1]
+        source_pixels = min(source_pixels, int(reduced))
+
+    if options["flip_horizontal"] or options["flip_vertical"]:
+        output_pixels *= 2
+
+    bytes_per_pixel = BYTES_PER_PIXEL.get(img.mode, 4)
+    return 2 * source_pixels * bytes_per_pixel + output_pixels * 4
+
+
+def _output_sizes(width, height, options):
+    """Return the sizes written for an oriented width x height source (one per --sizes rung)."""
+    if options["sizes"]:
+        return [_compute_minmax_size(width, height, options["min_dimension"], size)
+                for size in sorted(options["sizes"], reverse=True)]
+    if options["box"] is not None:
+        return [tuple(options["box"])]
+    return [_scaled_target_size(width, height, options)]
+
+
+def _scan_header(img_path, options):
+    """Describe one input and the work it needs, reading only its header.
+
+    action is one of: copy (--copy_through byte copy), noop (same size,
+    re-encode only), downscale, upscale, box-crop (any box fit that changes
+    the image) or unreadable. cost is the pixels decoded plus the pixels
+    written, the relative work used to schedule the biggest jobs first.
+    """
+    try:
+        with Image.open(img_path) as img:
+            width, height = _oriented_size(img)
+            try:
+                orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            except Exception:
+                orientation = 1
+            output_sizes = _output_sizes(width, height, options)
+            source_pixels = width * height
+            output_pixels = sum(w * h for w, h in output_sizes)
+
+            if options["copy_through"] and _needs_no_change(img, options):
+                action = "copy"
+            elif options["box"] is not None:
+                action = "noop" if output_sizes[0] == (width, height) else "box-crop"
+            elif output_pixels > source_pixels * len(output_sizes):
+                action = "upscale"
+            elif output_pixels < source_pixels * len(output_sizes):
+                action = "downscale"
+            else:
+                action = "noop"
+
+            target_size = output_sizes[0] if options["box"] is None else _scaled_target_size(width, height, options)
+            if options["fast_decode"] and target_size is not None:
+                source_pixels = min(source_pixels, int((2 * options["reducing_gap"]) ** 2 * target_size[0] * target_size[1]))
+
+            return {
+                "width": width,
+                "height": height,
+                "mode": img.mode,
+                "format": img.format,
+                "orientation": orientation,
+                "action": action,
+                "output_sizes": output_sizes,
+                "cost": 0 if action == "copy" else source_pixels + output_pixels,
+                "memory": 0 if action == "copy" else _estimate_memory(img, options),
+            }
+    except Exception as e:
+        # The worker reports the real error when the file is processed
+        return {"action": "unreadable", "error": str(e), "output_sizes": [], "cost": 0, "memory": 0}
+
+
+def _scan_headers(jobs, options, workers=1):
+    """Scan every job's header; I/O bound, so threads overlap the opens on slow shares."""
+    with ThreadPoolExecutor(max_workers=max(4, workers)) as pool:
+        return list(pool.map(lambda job: _scan_header(job[1], options), jobs))
+
+
+PLAN_ACTIONS = ("copy", "noop", "downscale", "upscale", "box-crop", "unreadable")
+
+
+def _print_plan(jobs, plan, verbose=False):
+    """Print the per-action summary of a header scan, and every file when verbose."""
+    if verbose:
+        for job, scan in zip(jobs, plan):
+            if scan["action"] == "unreadable":
+                print(f"{job[0]}: unreadable ({scan['error']})")
+                continue
+            sizes = ", ".join(f"{w}x{h}" for w, h in scan["output_sizes"])
+            print(f"{job[0]}: {scan['width']}x{scan['height']} {scan['format']} {scan['mode']} -> {sizes} ({scan['action']})")
+
+    total_cost = sum(scan["cost"] for scan in plan) or 1
+    print("Plan:")
+    for action in PLAN_ACTIONS:
+        group = [scan for scan in plan if scan["action"] == action]
+        if group:
+            cost = sum(scan["cost"] for scan in group)
+            output_pixels = sum(w * h for scan in group for w, h in scan["output_sizes"])
+            print(f"  {action:<11} {len(group):>7} files  {cost / total_cost:>6.1%} of work  {output_pixels / 1e6:>10.1f} MP out")
+
+
+def _job_options(options, cost, max_memory):
+    """Return the options for one job; oversize jobs take the reduced-decode path."""
+    if max_memory is not None and cost > max_memory and not options["fast_decode"]:
+        return dict(options, fast_decode=True)
+    return options
+
+
+# Per-file stage timings for --profile; None on threads that aren't recording
+_profile_state = threading.local()
+
+PROFILE_PERCENTILES = (50, 90, 99)
+
+
+@contextlib.contextmanager
+def _stage(name, target_ext=None):
+    """Add the wall and CPU time of the enclosed block to the current file's profile, if one is recording.
+
+    CPU time is the calling thread's, so it stays per file under a thread
+    pool. Save times are also kept per target_ext.
+    """
+    profile = getattr(_profile_state, "profile", None)
+    if profile is None:
+        yield
+        return
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - wall, time.thread_time() - cpu)
+        for totals in (profile["stages"].setdefault(name, [0.0, 0.0]),
+                       profile["formats"].setdefault(target_ext, [0.0, 0.0]) if target_ext else None):
+            if totals is not None:
+                totals[0] += elapsed[0]
+                totals[1] += elapsed[1]
+
+
+def _profiled_call(func, use_cprofile, use_tracemalloc, img_path, output_path, options):
+    """Run func(img_path, output_path, options) while recording a profile; returns (result, profile).
+
+    Module-level (wrapped with functools.partial) so it can run in process
+    pool workers. cProfile stats come back as the plain dict pstats reads;
+    the tracemalloc peak only covers Python allocations, not Pillow's pixel
+    buffers, and is process-wide under a thread pool.
+    """
+    import cProfile
+    import tracemalloc
+
+    profile = {"stages": {}, "formats": {}}
+    profiler = cProfile.Profile() if use_cprofile else None
+    if use_tracemalloc:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+    _profile_state.profile = profile
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        result = func(img_path, output_path, options)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        _profile_state.profile = None
+    profile["wall"] = time.perf_counter() - wall
+    profile["cpu"] = time.thread_time() - cpu
+    if use_tracemalloc:
+        profile["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+    if profiler is not None:
+        profiler.create_stats()
+        profile["cprofile"] = profiler.stats
+    return result, profile
+
+
+def _percentiles(values):
+    """Summarize values with nearest-rank percentiles (PROFILE_PERCENTILES), mean and max."""
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    summary = {"count": len(values), "mean": round(sum(values) / len(values), 6)}
+    for percentile in PROFILE_PERCENTILES:
+        rank = max(1, -(-percentile * len(values) // 100))
+        summary[f"p{percentile}"] = round(values[rank - 1], 6)
+    summary["max"] = round(values[-1], 6)
+    return summary
+
+
+class _MergedStats:
+    """Adapter so pstats.Stats can load a stats dict returned from a worker."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def _profile_report(profiles, meta, cprofile_path=None, top=25):
+    """Build the --profile JSON report from {filename: profile}; optionally dump merged cProfile stats."""
+    stages = {}
+    formats = {}
+    for profile in profiles.values():
+        for name, (wall, cpu) in profile["stages"].items():
+            stages.setdefault(name, ([], []))
+            stages[name][0].append(wall)
+            stages[name][1].append(cpu)
+        for ext, (wall, cpu) in profile["formats"].items():
+            formats.setdefault(ext, ([], []))
+            formats[ext][0].append(wall)
+            formats[ext][1].append(cpu)
+
+    report = {
+        "meta": meta,
+        "files": [
+            {
+                "file": filename,
+                "wall": round(profile["wall"], 6),
+                "cpu": round(profile["cpu"], 6),
+                "stages": {name: {"wall": round(wall, 6), "cpu": round(cpu, 6)} for name, (wall, cpu) in profile["stages"].items()},
+                **({"peak_traced_bytes": profile["peak_traced_bytes"]} if "peak_traced_bytes" in profile else {}),
+            }
+            for filename, profile in profiles.items()
+        ],
+        "total": {
+            "wall": _percentiles([profile["wall"] for profile in profiles.values()]),
+            "cpu": _percentiles([profile["cpu"] for profile in profiles.values()]),
+        },
+        "stages": {name: {"wall": _percentiles(walls), "cpu": _percentiles(cpus)} for name, (walls, cpus) in stages.items()},
+        "formats": {ext: {"save": {"wall": _percentiles(walls), "cpu": _percentiles(cpus)}} for ext, (walls, cpus) in formats.items()},
+    }
+    peaks = [profile["peak_traced_bytes"] for profile in profiles.values() if "peak_traced_bytes" in profile]
+    if peaks:
+        report["tracemalloc"] = {"peak_traced_bytes": _percentiles(peaks)}
+
+    cprofiles = [profile["cprofile"] for profile in profiles.values() if "cprofile" in profile]
+    if cprofiles:
+        import pstats
+
+        merged = pstats.Stats(_MergedStats(cprofiles[0]))
+        for stats in cprofiles[1:]:
+            merged.add(_MergedStats(stats))
+        if cprofile_path:
+            merged.dump_stats(cprofile_path)
+        functions = sorted(merged.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+        report["cprofile"] = [
+            {"function": f"{filename}:{line}({name})", "calls": calls, "tottime": round(tottime, 6), "cumtime": round(cumtime, 6)}
+            for (filename, line, name), (_, calls, tottime, cumtime, _) in functions
+        ]
+    return report
+
+
+def _print_profile(report):
+    """Print the per-stage wall-time percentiles of a --profile report."""
+    print(f"\n{'stage':<16} {'files':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'cpu p50 ms':>11}")
+    for name, summary in [("total", report["total"])] + list(report["stages"].items()):
+        wall, cpu = summary["wall"], summary["cpu"]
+        print(f"{name:<16} {wall['count']:>6} {wall['p50'] * 1000:>9.1f} {wall['p90'] * 1000:>9.1f} "
+              f"{wall['p99'] * 1000:>9.1f} {cpu['p50'] * 1000:>11.1f}")
+    for ext, summary in report["formats"].items():
+        wall = summary["save"]["wall"]
+        print(f"{'save' + ext:<16} {wall['count']:>6} {wall['p50'] * 1000:>9.1f} {wall['p90'] * 1000:>9.1f} "
+              f"{wall['p99'] * 1000:>9.1f} {summary['save']['cpu']['p50'] * 1000:>11.1f}")
+
+
+def _run_jobs(jobs, func, options, workers=1, executor="process", progress_order="input", costs=None, max_memory=None):
+    """Run func(*job[1:], options) for every job and yield (job, result, error) triples.
+
+    jobs are tuples whose first item is the display name. With workers <= 1 the
+    jobs run serially in this process. Otherwise they are spread over a process
+    or thread pool and yielded in input order ("input") or as soon as each one
+    finishes ("completion").
+
+    With max_memory (bytes) and per-job estimated costs, jobs are only admitted
+    while the running total fits the budget. A job larger than the whole
+    budget waits for the pool to drain, runs alone, and uses the
+    reduced-decode path.
+    """
+    costs = costs or [0] * len(jobs)
+    if workers <= 1:
+        for job, cost in zip(jobs, costs):
+            try:
+                result = func(*job[1:], _job_options(options, cost, max_memory))
+            except Exception as e:
+                yield job, None, e
+            else:
+                yield job, result, None
+        return
+
+    if executor == "thread":
+        pool_cls = ThreadPoolExecutor
+    elif executor == "process":
+        pool_cls = ProcessPoolExecutor
+    else:
+        raise ValueError(f"Unsupported executor '{executor}'. Use: process, thread")
+    if progress_order not in ("input", "completion"):
+        raise ValueError(f"Unsupported progress order '{progress_order}'. Use: input, completion")
+
+    with pool_cls(max_workers=workers) as pool:
+        pending = collections.deque(enumerate(jobs))
+        running = {}
+        in_use = 0
+        held = {}
+        next_position = 0
+        while pending or running:
+            # Keep the pool fed, but only a couple of jobs per worker ahead and within budget
+            while pending and len(running) < 2 * workers:
+                position, job = pending[0]
+                cost = costs[position]
+                if max_memory is not None and running and in_use + cost > max_memory:
+                    break
+                pending.popleft()
+                future = pool.submit(func, *job[1:], _job_options(options, cost, max_memory))
+                running[future] = (position, job, cost)
+                in_use += cost
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                position, job, cost = running.pop(future)
+                in_use -= cost
+                error = future.exception()
+                held[position] = (job, None if error else future.result(), error)
+
+            if progress_order == "completion":
+                for position in sorted(held):
+                    yield held.pop(position)
+            while next_position in held:
+                yield held.pop(next_position)
+                next_position += 1
+
+
+def _in_input_order(results, jobs):
+    """Re-yield (job, result, error) triples in the order their jobs appear in jobs."""
+    positions = {job[0]: position for position, job in enumerate(jobs)}
+    held = {}
+    next_position = 0
+    for item in results:
+        held[positions[item[0][0]]] = item
+        while next_position in held:
+            yield held.pop(next_position)
+            next_position += 1
+
+
+class _MemoryBudget:
+    """Blocking byte budget shared by pipeline stages. A job that exceeds the
+    whole budget is admitted only when nothing else holds any of it."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, cost):
+        with self.condition:
+            while self.in_use and self.in_use + cost > self.limit:
+                self.condition.wait()
+            self.in_use += cost
+
+    def release(self, cost):
+        with self.condition:
+            self.in_use -= cost
+            self.condition.notify_all()
+
+
+_PIPELINE_DONE = object()
+
+
+def _run_pipeline(jobs, options, workers=1, executor="process", progress_order="input",
+                  readers=2, read_ahead=8, write_queue=8, write_batch=16, costs=None, max_memory=None, sink=_write_output_batch,
+                  hash_inputs=False, claims=None, fingerprint=None):
+    """Stream jobs through overlapped read -> transform -> write stages.
+
+    Same (job, result, error) interface as _run_jobs. Reader threads prefetch
+    input bytes into a queue of at most `read_ahead` files. A process or
+    thread pool decodes, transforms and encodes them in memory. A single
+    writer thread takes up to `write_batch` queued results per wake-up and
+    hands them to sink together. At most `workers + write_queue` files are
+    being transformed or waiting to be written, so memory stays bounded on
+    huge batches and disk and CPU never wait on each other. With max_memory,
+    the transform stage also admits jobs by estimated cost, as in _run_jobs.
+    sink([(job, encoded)]) performs a batch's writes and returns the written
+    paths or the exception for each job.
+    An exception that escapes a stage (e.g. BrokenProcessPool after a worker
+    is killed) stops the pipeline and is re-raised here. With hash_inputs,
+    readers hash each file as they read it and results are (sha256, written);
+    with claims as well, duplicates fail with _DuplicateInput as in
+    _hashed_call, without being transformed.
+    """
+    if executor == "thread":
+        pool_cls = ThreadPoolExecutor
+    elif executor == "process":
+        pool_cls = ProcessPoolExecutor
+    else:
+        raise ValueError(f"Unsupported executor '{executor}'. Use: process, thread")
+    if progress_order not in ("input", "completion"):
+        raise ValueError(f"Unsupported progress order '{progress_order}'. Use: input, completion")
+
+    workers = max(1, workers)
+    pending = queue.Queue()
+    for position, job in enumerate(jobs):
+        pending.put((position, job))
+    read_q = queue.Queue(maxsize=max(1, read_ahead))
+    write_q = queue.Queue()
+    result_q = queue.Queue()
+    in_flight = threading.BoundedSemaphore(workers + max(1, write_queue))
+    costs = costs or [0] * len(jobs)
+    budget = _MemoryBudget(max_memory) if max_memory is not None else None
+    digests = {}
+    # First exception that escaped a stage; once set, every stage winds down
+    failures = []
+    stopped = threading.Event()
+
+    def fail(error):
+        failures.append(error)
+        stopped.set()
+
+    def put_unless_stopped(q, item):
+        # A bounded put that gives up once another stage has failed
+        while not stopped.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get_unless_stopped(q):
+        while not stopped.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _PIPELINE_DONE
+
+    def read_stage():
+        try:
+            while not stopped.is_set():
+                try:
+                    position, job = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    with open(job[1], "rb") as f:
+                        item = (position, job, f.read(), None)
+                    if hash_inputs:
+                        digests[position] = hashlib.sha256(item[2]).hexdigest()
+                except Exception as e:
+                    item = (position, job, None, e)
+                put_unless_stopped(read_q, item)
+        except BaseException as e:
+            fail(e)
+
+    def transform_stage(pool):
+        # Released once each callback has queued its result; wait() on the
+        # futures can return before their callbacks have run
+        forwarded = threading.Semaphore(0)
+
+        def on_done(future, position, job):
+            error = future.exception()
+            write_q.put((position, job, None if error else future.result(), error))
+            forwarded.release()
+
+        submitted = 0
+        try:
+            remaining = len(jobs)
+            while remaining:
+                item = get_unless_stopped(read_q)
+                if item is _PIPELINE_DONE:
+                    return
+                position, job, data, error = item
+                remaining -= 1
+                while not in_flight.acquire(timeout=0.1):
+                    if stopped.is_set():
+                        return
+                if budget is not None:
+                    budget.acquire(costs[position])
+                if error is None and claims is not None:
+                    owner = claims.setdefault(f"{digests[position]}-{fingerprint}", job[1])
+                    if owner != job[1]:
+                        error = _DuplicateInput(digests[position], owner)
+                if error is not None:
+                    write_q.put((position, job, None, error))
+                    continue
+                job_options = _job_options(options, costs[position], max_memory)
+                future = pool.submit(_process_bytes, data, job[2], job_options, job[1])
+                future.add_done_callback(lambda f, p=position, j=job: on_done(f, p, j))
+                submitted += 1
+        except BaseException as e:
+            fail(e)
+        finally:
+            # Submitted jobs always finish (a broken pool fails them), so their results still get written
+            for _ in range(submitted):
+                forwarded.acquire()
+            write_q.put(_PIPELINE_DONE)
+
+    def write_stage():
+        try:
+            done = False
+            while not done:
+                batch = [write_q.get()]
+                while len(batch) < write_batch:
+                    try:
+                        batch.append(write_q.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch[-1] is _PIPELINE_DONE:
+                    done = True
+                    batch.pop()
+                writable = [(job, encoded) for _, job, encoded, error in batch if error is None]
+                try:
+                    written_batch = iter(sink(writable) if writable else ())
+                except Exception as e:
+                    written_batch = iter([e] * len(writable))
+                for position, job, encoded, error in batch:
+                    written = None
+                    if error is None:
+                        written = next(written_batch)
+                        if isinstance(written, Exception):
+                            written, error = None, written
+                    in_flight.release()
+                    if budget is not None:
+                        budget.release(costs[position])
+                    result_q.put((position, job, written, error))
+        except BaseException as e:
+            fail(e)
+        finally:
+            result_q.put(_PIPELINE_DONE)
+
+    with pool_cls(max_workers=workers) as pool:
+        stages = [threading.Thread(target=read_stage, daemon=True) for _ in range(max(1, readers))]
+        stages.append(threading.Thread(target=transform_stage, args=(pool,), daemon=True))
+        stages.append(threading.Thread(target=write_stage, daemon=True))
+        for stage in stages:
+            stage.start()
+
+        # Re-sequence completions when progress is wanted in input order
+        held = {}
+        next_position = 0
+        while True:
+            item = result_q.get()
+            if item is _PIPELINE_DONE:
+                break
+            position, job, written, error = item
+            digest = digests.pop(position, None)
+            if hash_inputs and error is None:
+                written = (digest, written)
+            if progress_order == "completion":
+                yield job, written, error
+                continue
+            held[position] = (job, written, error)
+            while next_position in held:
+                yield held.pop(next_position)
+                next_position += 1
+        if failures:
+            raise failures[0]
+
+
+class _BudgetExceeded(Exception):
+    """A file broke its --file_timeout/--file_memory budget (or crashed its worker) and is quarantined."""
+
+
+def _address_space_bytes():
+    """Return this process's virtual address space size, or 0 where /proc/self/statm isn't available."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def _isolated_worker(conn, memory_limit):
+    """Worker loop for _run_isolated: receive (func, args), send back (ok, result or exception).
+
+    Each task is acknowledged with None when it starts, so the time budget
+    doesn't include the worker's own start-up. RLIMIT_AS counts the whole
+    address space, so memory_limit is added on top of what the idle worker
+    (interpreter, Pillow and its plugins) already maps.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _require_pillow()
+    Image.init()
+    if memory_limit and resource is not None:
+        limit = _address_space_bytes() + memory_limit
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    while True:
+        task = conn.recv()
+        if task is None:
+            return
+        conn.send(None)
+        func, args = task
+        try:
+            reply = (True, func(*args))
+        except MemoryError:
+            reply = (False, _BudgetExceeded(f"exceeded memory budget of {memory_limit // (1024 * 1024)} MB"))
+        except Exception as e:
+            reply = (False, e)
+        try:
+            conn.send(reply)
+        except Exception:
+            # Unpicklable exception or result
+            conn.send((False, RuntimeError(f"{type(reply[1]).__name__}: {reply[1]}")))
+
+
+def _run_isolated(jobs, func, options, workers=1, progress_order="input", timeout=None, memory_limit=None,
+                  costs=None, max_memory=None):
+    """Like _run_jobs, but each worker is a dedicated process that can be killed on its own.
+
+    A job that runs longer than timeout seconds has its worker killed; one
+    that hits the memory_limit (bytes of address space per worker beyond
+    its idle footprint, Unix only) gets a MemoryError; one that kills its worker outright (e.g. a
+    decoder segfault) is detected from the worker's exit. All three come
+    back as _BudgetExceeded errors and a fresh worker replaces the old one,
+    so the rest of the batch carries on at full width.
+    """
+    if progress_order not in ("input", "completion"):
+        raise ValueError(f"Unsupported progress order '{progress_order}'. Use: input, completion")
+    costs = costs or [0] * len(jobs)
+    context = multiprocessing.get_context()
+
+    def spawn():
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(target=_isolated_worker, args=(child_conn, memory_limit), daemon=True)
+        process.start()
+        child_conn.close()
+        # [process, connection, (position, job, cost) or None, deadline once the job started]
+        return [process, parent_conn, None, None]
+
+    def retire(slot, graceful=False):
+        if graceful:
+            try:
+                slot[1].send(None)
+                slot[0].join(timeout=1)
+            except OSError:
+                pass
+        slot[1].close()
+        if slot[0].is_alive():
+            slot[0].kill()
+        slot[0].join()
+
+    slots = [spawn() for _ in range(max(1, min(workers, len(jobs))))]
+    pending = collections.deque(enumerate(jobs))
+    in_use = 0
+    held = {}
+    next_position = 0
+    try:
+        while pending or any(slot[2] is not None for slot in slots):
+            for slot in slots:
+                if slot[2] is not None or not pending:
+                    continue
+                position, job = pending[0]
+                cost = costs[position]
+                if max_memory is not None and in_use and in_use + cost > max_memory:
+                    break
+                pending.popleft()
+                in_use += cost
+                slot[1].send((func, (*job[1:], _job_options(options, cost, max_memory))))
+                slot[2] = (position, job, cost)
+
+            busy = [slot for slot in slots if slot[2] is not None]
+            deadlines = [slot[3] for slot in busy if slot[3] is not None]
+            wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            multiprocessing.connection.wait([slot[1] for slot in busy] + [slot[0].sentinel for slot in busy], wait_for)
+
+            for index, slot in enumerate(slots):
+                if slot[2] is None:
+                    continue
+                position, job, cost = slot[2]
+                outcome = None
+                try:
+                    while outcome is None and slot[1].poll():
+                        message = slot[1].recv()
+                        if message is None:
+                            # The worker started the job; its time budget runs from here
+                            slot[3] = time.monotonic() + timeout if timeout else None
+                        else:
+                            ok, payload = message
+                            outcome = (payload, None) if ok else (None, payload)
+                except (EOFError, OSError):
+                    pass
+                if outcome is None and not slot[0].is_alive():
+                    outcome = (None, _BudgetExceeded(f"worker died (exit code {slot[0].exitcode})"))
+                if outcome is None and slot[3] is not None and time.monotonic() >= slot[3]:
+                    outcome = (None, _BudgetExceeded(f"exceeded time budget of {timeout:g}s"))
+                if outcome is None:
+                    continue
+
+                in_use -= cost
+                slot[2] = slot[3] = None
+                if isinstance(outcome[1], _BudgetExceeded):
+                    # Never reuse a worker that was killed, crashed or ran out of memory
+                    retire(slot)
+                    slots[index] = spawn()
+                held[position] = (job, *outcome)
+
+            if progress_order == "completion":
+                for position in sorted(held):
+                    yield held.pop(position)
+            while next_position in held:
+                yield held.pop(next_position)
+                next_position += 1
+    finally:
+        for slot in slots:
+            retire(slot, graceful=slot[2] is None)
+
+
+QUARANTINE_FILENAME = ".resize-quarantine.json"
+
+
+def _load_quarantine(output_dir):
+    """Load the quarantine list: {"<input name>": {"reason": ..., "size": ..., "mtime_ns": ...}}."""
+    path = os.path.join(output_dir, QUARANTINE_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_quarantine(output_dir, quarantine):
+    path = os.path.join(output_dir, QUARANTINE_FILENAME)
+    _write_atomically(path, lambda tmp_path: _write_bytes(tmp_path, json.dumps(quarantine, indent=4).encode("utf-8")))
+
+
+@dataclass(frozen=True)
+class ResizeJob:
+    """What resize_bytes() should do to one image; fields mirror the CLI options of the same name."""
+    format: str = DEFAULT_OPTIONS["target_ext"]
+    box: tuple[int, int] | None = None
+    box_mode: str = DEFAULT_OPTIONS["box_mode"]
+    # Unlike the CLI, no upscaling unless asked, so ResizeJob(max_dimension=512) just caps the size
+    min_dimension: int | None = None
+    max_dimension: int | None = DEFAULT_OPTIONS["max_dimension"]
+    quality: int | None = None
+    pad_color: str = DEFAULT_OPTIONS["pad_color"]
+    fast_decode: bool = False
+    reducing_gap: float = DEFAULT_OPTIONS["reducing_gap"]
+    copy_through: bool = False
+
+    def options(self):
+        """Validate the job and return the options dict used by the file-based pipeline."""
+        ext = "." + self.format.lower().lstrip(".")
+        ext = TARGET_EXT_ALIASES.get(ext, ext)
+        if ext not in TARGET_FORMATS:
+            raise ValueError(f"Unsupported format '{self.format}'. Use: {', '.join(TARGET_FORMATS)}")
+        if self.box_mode not in ("clip", "cover", "contain"):
+            raise ValueError(f"Unsupported box_mode '{self.box_mode}'. Use: clip, cover, contain")
+        if (self.box is None and self.min_dimension is not None and self.max_dimension is not None
+                and self.min_dimension > self.max_dimension):
+            raise ValueError("min_dimension cannot be greater than max_dimension.")
+        if self.reducing_gap < 1:
+            raise ValueError("reducing_gap must be at least 1.")
+        return _make_options(
+            target_ext=ext,
+            box=tuple(self.box) if self.box else None,
+            box_mode=self.box_mode,
+            min_dimension=self.min_dimension,
+            max_dimension=self.max_dimension,
+            quality=self.quality,
+            pad_color=self.pad_color,
+            fast_decode=self.fast_decode,
+            reducing_gap=self.reducing_gap,
+            copy_through=self.copy_through,
+        )
+
+
+@dataclass(frozen=True)
+class ResizeResult:
+    """Encoded output of resize_bytes() plus what a caller needs to store or serve it."""
+    data: bytes
+    format: str
+    width: int
+    height: int
+    source_format: str | None
+    source_width: int
+    source_height: int
+    copied: bool = False
+
+
+def resize_bytes(data, job=None):
+    """Resize one image held in memory and return a ResizeResult; nothing touches the filesystem.
+
+    `data` is bytes-like or a readable binary buffer. Raises
+    Image.UnidentifiedImageError for undecodable input and ValueError for an
+    invalid job.
+    """
+    _require_pillow()
+    job = job or ResizeJob()
+    options = job.options()
+    if hasattr(data, "read"):
+        data = data.read()
+    data = bytes(data)
+    try:
+        img = Image.open(io.BytesIO(data))
+    except Image.UnidentifiedImageError:
+        raise Image.UnidentifiedImageError("cannot identify image data") from None
+    with img:
+        source_format = img.format
+        source_width, source_height = _oriented_size(img)
+        if options["copy_through"] and _needs_no_change(img, options):
+            return ResizeResult(data, options["target_ext"], img.width, img.height, source_format,
+                                source_width, source_height, copied=True)
+        # Without sizes/formats/flips there is exactly one output; the path is only used for naming
+        _, resized_img, ext = next(_render_outputs(img, "image" + options["target_ext"], options))
+        buffer = io.BytesIO()
+        _save_image(resized_img, buffer, ext, quality=options["quality"])
+    return ResizeResult(buffer.getvalue(), ext, resized_img.width, resized_img.height, source_format,
+                        source_width, source_height)
+
+
+class ResizePool:
+    """A warm worker pool for resize_bytes(); keep one for the life of a service and reuse it across batches.
+
+    Workers import Pillow once when they start, so each job pays only for its
+    decode, resize and encode.
+    """
+
+    def __init__(self, workers=None, executor="process"):
+        if executor not in ("process", "thread"):
+            raise ValueError(f"Unsupported executor '{executor}'. Use: process, thread")
+        pool_cls = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        self._pool = pool_cls(max_workers=workers, initializer=_require_pillow)
+
+    def submit(self, data, job=None):
+        """Queue one image; returns a Future resolving to a ResizeResult."""
+        if hasattr(data, "read"):
+            data = data.read()
+        return self._pool.submit(resize_bytes, bytes(data), job)
+
+    def map(self, items, return_exceptions=False):
+        """Run a batch of (data, job) pairs and return results in input order.
+
+        With return_exceptions=True a failing image yields its exception in
+        place of a result instead of raising.
+        """
+        futures = [self.submit(data, job) for data, job in items]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    def close(self):
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def resize_images(dir_path, output_dir, min_dimension, max_dimension, target_ext, rename=False, box=None, box_mode="clip", pad_color="black",
+                  workers=1, executor="process", progress_order="input", fast_decode=False, reducing_gap=2.0, quality=None,
+                  incremental=False, content_hash=False, sizes=None, formats=None,
+                  pipeline=False, readers=2, read_ahead=8, write_queue=8, write_batch=16, copy_through=False,
+                  flip_horizontal=False, flip_vertical=False, emit_original=False, max_memory=None, dedupe=None, plan=False,
+                  shards=None, shard_size=1 << 30, profile=None, profile_cprofile=None, profile_tracemalloc=False,
+                  file_timeout=None, file_memory=None, retry_quarantined=False, optimize=False, optimize_budget=2.0):
     _require_pillow()
     # Check if the directory exists
     if not os.path.isdir(dir_path):
         print(f"Error: The directory '{dir_path}' does not exist.")
         return
 
-    # Create the output directory if it doesn't exist
-    if not os.path.exists(output_dir):
+    # Create the output directory if it doesn't exist (a --plan dry run writes nothing)
+    if not plan and not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
     # Validate the target extension
@@ -199,73 +2056,315 @@ def resize_images(dir_path, output_dir, min_dimension, max_dimension, target_ext
         print(f"Error: Unsupported file extension '{target_ext}'. Only .jpg, .png, .webp, .avif, and .heic are supported.")
         return
 
+    if sizes:
+        formats = formats or [target_ext]
+        unsupported = [ext for ext in formats if ext not in ['.jpg', '.png', '.webp', '.avif', '.heic']]
+        if unsupported:
+            print(f"Error: Unsupported --formats {', '.join(unsupported)}. Only .jpg, .png, .webp, .avif, and .heic are supported.")
+            return
+        if box is not None:
+            print("Error: --sizes cannot be combined with --box.")
+            return
+        for size in sizes if not (plan or shards) else ():
+            os.makedirs(os.path.join(output_dir, str(size)), exist_ok=True)
+
+    if dedupe not in (None, "link", "alias"):
+        print(f"Error: Unsupported --dedupe '{dedupe}'. Use: link, alias")
+        return
+    if dedupe == "alias" and not incremental:
+        print("Error: --dedupe alias records aliases in the manifest and requires --incremental.")
+        return
+    if shards not in (None, "tar", "zip"):
+        print(f"Error: Unsupported --shards '{shards}'. Use: tar, zip")
+        return
+    if shards and dedupe:
+        print("Error: --shards cannot be combined with --dedupe.")
+        return
+    if profile and pipeline:
+        print("Error: --profile times the per-file path and cannot be combined with --pipeline.")
+        return
+    if optimize and shards:
+        print("Error: --optimize rewrites output files and cannot be combined with --shards.")
+        return
+    if (file_timeout or file_memory) and pipeline:
+        print("Error: --file_timeout/--file_memory run each file in its own killable worker and cannot be combined with --pipeline.")
+        return
+
     unsuccessful_conversions = []
 
     # Gather all image files to process
-    valid_exts = (".jpg", ".png", ".jpeg", ".webp", ".avif", ".heic")
-    all_files = [f for f in os.listdir(dir_path) if f.lower().endswith(valid_exts)]
+    all_files = sorted(f for f in os.listdir(dir_path) if f.lower().endswith(INPUT_EXTS))
     total_files = len(all_files)
     print(f"Found {total_files} image files to process.")
 
-    for idx, filename in enumerate(all_files):
+    options = _make_options(
+        min_dimension=min_dimension,
+        max_dimension=max_dimension,
+        target_ext=target_ext,
+        box=box,
+        box_mode=box_mode,
+        pad_color=pad_color,
+        fast_decode=fast_decode,
+        reducing_gap=reducing_gap,
+        quality=quality,
+        sizes=sizes,
+        formats=formats,
+        copy_through=copy_through,
+        flip_horizontal=flip_horizontal,
+        flip_vertical=flip_vertical,
+        emit_original=emit_original,
+    )
+
+    # With --incremental, the manifest records what each input was last turned into
+    manifest = _load_manifest(output_dir) if incremental else None
+    fingerprint = _params_fingerprint(options)
+    records = {}
+
+    # With --dedupe, inputs are keyed by content hash + parameters, hashed by
+    # the workers as they read them. Only the first input per key is
+    # processed; the others reuse its outputs.
+    store = _load_content_store(output_dir) if dedupe else None
+    followers = collections.defaultdict(list)
+    failed = set()
+    aliased = set()
+    duplicates = 0
+    # Existing files that dedupe links may replace: outputs the manifest, the content store or this run wrote
+    owned = set()
+    for entry in (store or {}).values():
+        owned.update(os.path.abspath(os.path.join(output_dir, path)) for path in entry["outputs"])
+    for record in (manifest or {}).values():
+        owned.update(os.path.abspath(os.path.join(output_dir, path)) for path in record.get("outputs", [record["output"]]))
+
+    folder_name = os.path.basename(os.path.normpath(output_dir))
+    next_number = _next_sequence_number(output_dir, [str(size) for size in sizes or ()]) if rename else None
+    numbered = []
+    outputs = {}
+
+    # Inputs that blew a budget or crashed a worker before are skipped until they change
+    quarantine = _load_quarantine(output_dir)
+    quarantined = 0
+
+    jobs = []
+    for filename in all_files:
+        img_path = os.path.join(dir_path, filename)
+        if filename in quarantine and not retry_quarantined:
+            stat = os.stat(img_path)
+            if (quarantine[filename]["size"], quarantine[filename]["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+                quarantined += 1
+                continue
+        previous = None
+        if manifest is not None:
+            stat = os.stat(img_path)
+            records[filename] = {
+                "input": filename,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": None,
+                "params": fingerprint,
+            }
+            previous = manifest.get(filename)
+            if _manifest_unchanged(previous, records[filename], output_dir, img_path if content_hash else None):
+                if (previous["size"], previous["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+                    # Touched but identical: remember the new stat so the next run doesn't hash it again
+                    manifest[filename] = dict(previous, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                continue
+
+        # Sequential names are assigned here, in sorted input order, so workers
+        # write straight to their final name. Numbers left unused by failed
+        # files and aliased duplicates stay as gaps; with --incremental a
+        # failed file's number is kept in the manifest and reused on retry.
+        if rename and previous is not None and _sequence_number(previous["output"], output_dir) is not None:
+            # A changed or previously failed input keeps the number it was given before
+            resized_img_path = os.path.join(output_dir, os.path.splitext(os.path.basename(previous["output"]))[0] + target_ext)
+        elif rename:
+            resized_img_path = os.path.join(output_dir, f"{folder_name} ({next_number}){target_ext}")
+            numbered.append((next_number, filename))
+            next_number += 1
+        else:
+            resized_img_path = os.path.join(output_dir, os.path.splitext(filename)[0] + target_ext)
+        jobs.append((filename, img_path, resized_img_path))
+
+    if quarantined:
+        print(f"Skipping {quarantined} quarantined files (see {QUARANTINE_FILENAME}; --retry_quarantined tries them again).")
+    if manifest is not None:
+        print(f"Skipping {total_files - len(jobs) - quarantined} unchanged files; {len(jobs)} to process.")
+    if manifest is not None and not plan:
+        manifest_file = open(os.path.join(output_dir, MANIFEST_FILENAME), "a", encoding="utf-8")
+
+    def record_success(filename, written):
+        outputs[filename] = written
+        owned.update(os.path.abspath(path) for path in written)
+        if manifest is not None:
+            # Persist each success immediately so a crashed run can resume
+            record = dict(records[filename], output=os.path.relpath(written[0], output_dir),
+                          outputs=[os.path.relpath(path, output_dir) for path in written])
+            manifest[filename] = record
+            manifest_file.write(json.dumps(record) + "\n")
+            manifest_file.flush()
+
+    def reuse(filename, output_path, entry, source):
+        nonlocal duplicates
         try:
-            img_path = os.path.join(dir_path, filename)
-            img = Image.open(img_path)
+            written = _reuse_outputs(entry, output_path, output_dir, dedupe, owned)
+        except Exception as e:
+            print(f"Failed to reuse outputs for duplicate {filename}: {e}")
+            unsuccessful_conversions.append(filename)
+            return
+        print(f"Duplicate {filename}: reused outputs of {source}")
+        duplicates += 1
+        if dedupe == "alias":
+            aliased.add(filename)
+        record_success(filename, written)
+
+    # Header-only pre-scan: classify the work, then schedule the biggest jobs
+    # first so parallel runs don't end on a long tail. It costs an extra open
+    # per file, so it only runs for --plan, --max_memory or when more jobs
+    # than workers make the order matter.
+    input_jobs = jobs
+    reorder = workers > 1 and len(jobs) > workers
+    scans = None
+    if plan or max_memory is not None or reorder:
+        scans = _scan_headers(jobs, options, workers)
+        _print_plan(jobs, scans, verbose=plan)
+    if plan:
+        return
+    if reorder:
+        order = sorted(range(len(jobs)), key=lambda position: -scans[position]["cost"])
+        jobs = [jobs[position] for position in order]
+        scans = [scans[position] for position in order]
+    # Progress in input order is re-sequenced here by each job's original position
+    run_order = "completion" if reorder and progress_order == "input" else progress_order
+
+    costs = None
+    if max_memory is not None:
+        costs = [scan["memory"] for scan in scans]
+        oversize = sum(1 for cost in costs if cost > max_memory)
+        if oversize:
+            print(f"{oversize} files exceed the memory budget and will run one at a time with a reduced decode.")
+
+    profiles = {}
+    # With --hash or --dedupe, workers hash each input from the bytes they read and return (sha256, result)
+    hash_inputs = (content_hash and manifest is not None) or bool(dedupe)
+    # With --dedupe, workers claim content keys in a shared dict before decoding. Keys
+    # whose outputs from an earlier run still exist are claimed up front by owner "".
+    claims = None
+    manager = None
+    if dedupe:
+        claims = {key: "" for key, entry in store.items()
+                  if all(os.path.exists(os.path.join(output_dir, path)) for path in entry["outputs"])}
+        if not pipeline and (file_timeout or file_memory or (workers > 1 and executor == "process")):
+            manager = multiprocessing.Manager()
+            claims = manager.dict(claims)
+    # With --shards, workers return encoded bytes and this process is the only archive writer
+    shard_writer = _ShardWriter(output_dir, kind=shards, max_bytes=shard_size) if shards else None
+
+    def shard_sink(batch):
+        # Pipeline sink for --shards: the writer thread appends each sample in order
+        results = []
+        for job, encoded in batch:
+            try:
+                results.append(shard_writer.add(job[0], encoded))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def fail_followers(filename):
+        # Duplicates of a failed input fail the same way
+        failed.add(filename)
+        for duplicate, _ in followers.pop(filename, ()):
+            print(f"Failed to process {duplicate}: duplicate of {filename}")
+            unsuccessful_conversions.append(duplicate)
 
-            if box is not None:
-                resized_img = _fit_to_box(img, box, box_mode=box_mode, pad_color=pad_color)
+    try:
+        if pipeline:
+            sink = shard_sink if shards else _write_output_batch
+            results = _run_pipeline(jobs, options, workers=workers, executor=executor, progress_order=run_order,
+                                    readers=readers, read_ahead=read_ahead, write_queue=write_queue, write_batch=write_batch,
+                                    costs=costs, max_memory=max_memory, sink=sink, hash_inputs=hash_inputs,
+                                    claims=claims, fingerprint=fingerprint)
+        else:
+            if hash_inputs:
+                func = functools.partial(_hashed_call, bool(shards), claims=claims, fingerprint=fingerprint)
             else:
-                img = ImageOps.exif_transpose(img)
-
-                width, height = img.size
-                # Calculate new size based on min and max dimension
-                # First, scale up if both dimensions are less than min_dimension
-                if min_dimension is not None and width < min_dimension and height < min_dimension:
-                    if width > height:
-                        ratio = min_dimension / width
-                    else:
-                        ratio = min_dimension / height
-                    new_width = int(width * ratio)
-                    new_height = int(height * ratio)
+                func = _encode_file if shards else _process_file
+            if profile:
+                func = functools.partial(_profiled_call, func, bool(profile_cprofile), profile_tracemalloc)
+            if file_timeout or file_memory:
+                results = _run_isolated(jobs, func, options, workers=workers, progress_order=run_order,
+                                        timeout=file_timeout, memory_limit=file_memory, costs=costs, max_memory=max_memory)
+            else:
+                results = _run_jobs(jobs, func, options, workers=workers, executor=executor,
+                                    progress_order=run_order, costs=costs, max_memory=max_memory)
+        if run_order != progress_order:
+            results = _in_input_order(results, input_jobs)
+        for done, (job, written, error) in enumerate(results, start=1):
+            filename = job[0]
+            if error is None and profile:
+                written, profiles[filename] = written
+            if error is None and hash_inputs:
+                digest, written = written
+                if manifest is not None:
+                    records[filename]["sha256"] = digest
+            if error is None and shards and not pipeline:
+                try:
+                    written = shard_writer.add(filename, written)
+                except Exception as e:
+                    error = e
+            if error is None:
+                print(f"{done}/{len(jobs)}: Processed {filename}")
+                record_success(filename, written)
+                if quarantine.pop(filename, None) is not None:
+                    _write_quarantine(output_dir, quarantine)
+                if dedupe:
+                    entry = {
+                        "stem": os.path.splitext(os.path.basename(job[2]))[0],
+                        "outputs": [os.path.relpath(path, output_dir) for path in written],
+                    }
+                    store[f"{digest}-{fingerprint}"] = entry
+                    for duplicate, output_path in followers.pop(filename, ()):
+                        reuse(duplicate, output_path, entry, filename)
+            elif isinstance(error, _DuplicateInput):
+                if manifest is not None:
+                    records[filename]["sha256"] = error.digest
+                key = f"{error.digest}-{fingerprint}"
+                owner = os.path.basename(error.owner)
+                if key in store:
+                    # Earlier run, or an input of this run that already finished
+                    reuse(filename, job[2], store[key], owner or store[key]["outputs"][0])
+                elif owner in failed:
+                    print(f"Failed to process {filename}: duplicate of {owner}")
+                    unsuccessful_conversions.append(filename)
                 else:
-                    new_width, new_height = width, height
-
-                # Then, scale down if any dimension is greater than max_dimension
-                if max_dimension is not None and (new_width > max_dimension or new_height > max_dimension):
-                    if new_width > new_height:
-                        ratio = max_dimension / new_width
-                    else:
-                        ratio = max_dimension / new_height
-                    new_width = int(new_width * ratio)
-                    new_height = int(new_height * ratio)
-
-                # Resize the image while maintaining aspect ratio
-                resized_img = img.resize((new_width, new_height), Image.LANCZOS)
-
-            # Use GUID filename if renaming is enabled, otherwise preserve original name
-            if rename:
-                guid_filename = generate_unique_guid(output_dir, target_ext)
-                resized_img_path = os.path.join(output_dir, guid_filename)
+                    followers[owner].append((filename, job[2]))
+            elif isinstance(error, (_BudgetExceeded, Image.DecompressionBombError)):
+                print(f"Quarantined {filename}: {error}")
+                stat = os.stat(job[1])
+                quarantine[filename] = {"reason": str(error), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+                _write_quarantine(output_dir, quarantine)
+                unsuccessful_conversions.append(filename)
+                fail_followers(filename)
             else:
-                resized_img_path = os.path.join(output_dir, os.path.splitext(filename)[0] + target_ext)
-
-            # Save the resized image in the target format
-            if target_ext == '.jpg':
-                resized_img = resized_img.convert("RGB")  # Ensure image is in RGB mode for JPEG
-                resized_img.save(resized_img_path, 'JPEG')
-            elif target_ext == '.png':
-                resized_img.save(resized_img_path, 'PNG')
-            elif target_ext == '.webp':
-                resized_img.save(resized_img_path, 'WEBP')
-            elif target_ext == '.avif':
-                resized_img.save(resized_img_path, 'AVIF')
-            elif target_ext == '.heic':
-                resized_img.save(resized_img_path, 'HEIF')
-
-            print(f"{idx+1}/{total_files}: Processed {filename}")
-        except Exception as e:
-            print(f"Failed to process {filename}: {e}")
-            unsuccessful_conversions.append(filename)
+                print(f"Failed to process {filename}: {error}")
+                unsuccessful_conversions.append(filename)
+                fail_followers(filename)
+    finally:
+        if shard_writer is not None:
+            shard_writer.close()
+        if manifest is not None:
+            manifest_file.close()
+        if manager is not None:
+            manager.shutdown()
+
+    if dedupe:
+        print(f"{duplicates} duplicate inputs reused existing outputs ({dedupe}).")
+
+    if optimize:
+        _optimize_outputs([path for written in outputs.values() for path in written], optimize_budget,
+                          workers=workers, executor=executor)
+
+    # Keep the failure report in input order regardless of progress order
+    input_order = {name: position for position, name in enumerate(all_files)}
+    unsuccessful_conversions.sort(key=input_order.get)
 
     # Log unsuccessful conversions
     if unsuccessful_conversions:
@@ -273,14 +2372,45 @@ def resize_images(dir_path, output_dir, min_dimension, max_dimension, target_ext
         for file in unsuccessful_conversions:
             print(file)
     
-    # Batch rename files if --rename flag is enabled
+    if rename and not shards:
+        # Renaming later outputs down over the gaps would be a second rename
+        # pass over the output tree, so gaps are left in place
+        gaps = [(number, filename) for number, filename in numbered if filename not in outputs or filename in aliased]
+        if gaps:
+            print(f"{len(gaps)} sequence numbers are unused by failed files and aliased duplicates.")
+        for number, filename in gaps:
+            if manifest is not None and filename not in outputs:
+                # Reserve the number: the retry reuses it because the output is missing
+                manifest[filename] = dict(records[filename], output=f"{folder_name} ({number}){target_ext}", outputs=[])
+
     if rename:
-        print(f"\nBatch renaming files...")
-        batch_rename_files(output_dir, target_ext)
         print(f"Resizing and renaming complete!")
     else:
         print(f"Resizing complete!")
 
+    if manifest is not None:
+        _write_manifest(output_dir, manifest)
+    if store is not None:
+        _write_content_store(output_dir, store)
+
+    if profile:
+        meta = {
+            "python": platform.python_version(),
+            "pillow": Image.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "workers": workers,
+            "executor": executor,
+            "options": {key: options[key] for key in FINGERPRINT_KEYS if key in options},
+            "files": len(profiles),
+        }
+        report = _profile_report(profiles, meta, cprofile_path=profile_cprofile)
+        with open(profile, "w") as f:
+            json.dump(report, f, indent=4)
+        if profiles:
+            _print_profile(report)
+        print(f"Profile written to {profile}")
+
 def flip_images(dir_path, output_dir, flip_horizontal=False, flip_vertical=False):
     _require_pillow()
     # Check if the directory exists
@@ -328,6 +2458,289 @@ def flip_images(dir_path, output_dir, flip_horizontal=False, flip_vertical=False
         for file in unsuccessful_flips:
             print(file)
 
+class _PollWatcher:
+    """Find new or changed input files under root by diffing os.scandir snapshots.
+
+    Only directories whose mtime changed since the last poll are listed again
+    (adding, removing or renaming a file bumps it), so an idle tree costs one
+    stat per directory. Every full_scan_every polls all files are stat'ed
+    again to catch files rewritten in place.
+    """
+
+    name = "scandir polling"
+
+    def __init__(self, root, exclude, interval=1.0, full_scan_every=30):
+        self.root = root
+        self.exclude = exclude
+        self.interval = interval
+        self.full_scan_every = full_scan_every
+        self.dirs = {}  # relative dir -> (mtime_ns, subdirs, file names)
+        self.files = {}  # relative path -> (size, mtime_ns)
+        self.polls = 0
+        self.initial = self._scan(full=True)
+        self.next_poll = time.monotonic() + interval
+
+    def _scan(self, full):
+        changed = []
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            path = os.path.join(self.root, rel_dir)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            previous = self.dirs.get(rel_dir)
+            if not full and previous is not None and previous[0] == mtime:
+                stack.extend(previous[1])
+                continue
+
+            subdirs, names = [], set()
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        rel = os.path.join(rel_dir, entry.name)
+                        if entry.is_dir(follow_symlinks=False):
+                            if os.path.realpath(entry.path) not in self.exclude:
+                                subdirs.append(rel)
+                        elif entry.name.lower().endswith(INPUT_EXTS):
+                            try:
+                                stat = entry.stat()
+                            except OSError:
+                                continue
+                            names.add(entry.name)
+                            key = (stat.st_size, stat.st_mtime_ns)
+                            if self.files.get(rel) != key:
+                                self.files[rel] = key
+                                changed.append(rel)
+            except OSError:
+                continue
+            for name in (previous[2] - names) if previous else ():
+                self.files.pop(os.path.join(rel_dir, name), None)
+            self.dirs[rel_dir] = (mtime, subdirs, names)
+            stack.extend(subdirs)
+        return changed
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds and return the relative paths that appeared or changed."""
+        now = time.monotonic()
+        if now < self.next_poll:
+            time.sleep(min(timeout, self.next_poll - now))
+            return []
+        self.polls += 1
+        self.next_poll = now + self.interval
+        return self._scan(full=self.polls % self.full_scan_every == 0)
+
+    def close(self):
+        pass
+
+
+class _InotifyWatcher:
+    """Find new or changed input files under root with inotify (Linux, needs inotify_simple).
+
+    Every directory gets a watch for files closed after writing, moved in or
+    created; new subdirectories are watched (and listed, for files created
+    before the watch existed) as they appear.
+    """
+
+    name = "inotify"
+
+    def __init__(self, root, exclude):
+        from inotify_simple import INotify, flags
+
+        self.root = root
+        self.exclude = exclude
+        self.flags = flags
+        self.inotify = INotify()
+        self.mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+        self.dirs = {}  # watch descriptor -> relative dir
+        self.initial = self._add_tree("")
+
+    def _add_tree(self, rel_root):
+        found = []
+        stack = [rel_root]
+        while stack:
+            rel_dir = stack.pop()
+            path = os.path.join(self.root, rel_dir)
+            try:
+                self.dirs[self.inotify.add_watch(path, self.mask)] = rel_dir
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        rel = os.path.join(rel_dir, entry.name)
+                        if entry.is_dir(follow_symlinks=False):
+                            if os.path.realpath(entry.path) not in self.exclude:
+                                stack.append(rel)
+                        elif entry.name.lower().endswith(INPUT_EXTS):
+                            found.append(rel)
+            except OSError:
+                continue
+        return found
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds and return the relative paths that appeared or changed."""
+        changed = []
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            if event.mask & self.flags.IGNORED:
+                self.dirs.pop(event.wd, None)
+                continue
+            rel_dir = self.dirs.get(event.wd)
+            if rel_dir is None or not event.name:
+                continue
+            rel = os.path.join(rel_dir, event.name)
+            if event.mask & self.flags.ISDIR:
+                if os.path.realpath(os.path.join(self.root, rel)) not in self.exclude:
+                    changed.extend(self._add_tree(rel))
+            elif event.name.lower().endswith(INPUT_EXTS):
+                changed.append(rel)
+        return changed
+
+    def close(self):
+        self.inotify.close()
+
+
+def _make_watcher(root, exclude, backend="auto", poll_interval=1.0):
+    """Return an inotify watcher when available (or requested), else a scandir polling watcher."""
+    if backend not in ("auto", "inotify", "poll"):
+        raise ValueError(f"Unsupported watch backend '{backend}'. Use: auto, inotify, poll")
+    if backend != "poll":
+        try:
+            return _InotifyWatcher(root, exclude)
+        except (ImportError, OSError) as e:
+            if backend == "inotify":
+                raise SystemExit(f"inotify watching is unavailable ({e}). Install with: pip install inotify_simple") from e
+    return _PollWatcher(root, exclude, interval=poll_interval)
+
+
+def _ignore_sigint():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def watch_images(dir_path, output_dir, options, workers=1, executor="process", debounce=1.0, poll_interval=1.0,
+                 stats_interval=60.0, backend="auto"):
+    """Resize new or changed images anywhere under dir_path as they land, until interrupted.
+
+    Outputs mirror the input's subfolder under output_dir, which is never
+    watched itself. A file is processed once its size and mtime have been
+    stable for `debounce` seconds, so files still being written are left
+    alone. Existing files whose output is already newer are not redone.
+    Every stats_interval seconds the throughput and the latency from a
+    file's last write to its output being written are printed; files
+    already present at startup count toward throughput only.
+    """
+    _require_pillow()
+    if not os.path.isdir(dir_path):
+        print(f"Error: The directory '{dir_path}' does not exist.")
+        return
+    os.makedirs(output_dir, exist_ok=True)
+
+    watcher = _make_watcher(dir_path, {os.path.realpath(output_dir)}, backend=backend, poll_interval=poll_interval)
+    print(f"Watching {dir_path} ({watcher.name}); press Ctrl+C to stop.")
+
+    def output_path_for(rel):
+        return os.path.join(output_dir, os.path.splitext(rel)[0] + options["target_ext"])
+
+    pending = {}  # relative path -> [(size, mtime_ns), monotonic time it last changed]
+    done = {}  # relative path -> (size, mtime_ns) of the version last processed
+    running = {}  # future -> (relative path, (size, mtime_ns))
+    # Existing files processed at startup -> their mtime_ns then; their age isn't a latency
+    backlog = {}
+    for rel in watcher.initial:
+        try:
+            stat = os.stat(os.path.join(dir_path, rel))
+        except OSError:
+            continue
+        try:
+            # Up to date only if every output the chain writes (ladder rungs, flips) is newer
+            output_mtime = min(os.stat(path).st_mtime_ns for path in _output_paths(output_path_for(rel), options))
+        except OSError:
+            output_mtime = None
+        if output_mtime is not None and output_mtime >= stat.st_mtime_ns:
+            done[rel] = (stat.st_size, stat.st_mtime_ns)
+        else:
+            pending[rel] = [None, 0.0]
+            backlog[rel] = stat.st_mtime_ns
+    if pending:
+        print(f"{len(pending)} existing files have no up-to-date output and will be processed.")
+
+    if executor == "thread":
+        pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    else:
+        # Ctrl+C is for this process; workers just finish or get cancelled
+        pool = ProcessPoolExecutor(max_workers=max(1, workers), initializer=_ignore_sigint)
+    tick = max(0.05, min(debounce, poll_interval) / 2)
+    started = next_stats = time.monotonic()
+    next_stats += stats_interval
+    processed = failed = 0
+    interval_processed = 0
+    latencies = []
+    try:
+        while True:
+            for rel in watcher.poll(tick):
+                pending.setdefault(rel, [None, 0.0])
+
+            # Debounce: submit files whose size and mtime have stopped changing
+            now = time.monotonic()
+            busy = {rel for rel, _ in running.values()}
+            for rel, state in list(pending.items()):
+                try:
+                    stat = os.stat(os.path.join(dir_path, rel))
+                except OSError:
+                    del pending[rel]  # Deleted or renamed away before it settled
+                    continue
+                key = (stat.st_size, stat.st_mtime_ns)
+                if key != state[0]:
+                    state[0], state[1] = key, now
+                    continue
+                if now - state[1] < debounce or rel in busy:
+                    continue
+                del pending[rel]
+                if done.get(rel) == key:
+                    continue
+                output_path = output_path_for(rel)
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                for size in options["sizes"] or ():
+                    os.makedirs(os.path.join(os.path.dirname(output_path), str(size)), exist_ok=True)
+                future = pool.submit(_process_file, os.path.join(dir_path, rel), output_path, options)
+                running[future] = (rel, key)
+
+            for future in [future for future in running if future.done()]:
+                rel, key = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    print(f"Failed to process {rel}: {error}")
+                    failed += 1
+                elif backlog.pop(rel, None) == key[1]:
+                    print(f"Processed {rel} (existing file)")
+                    processed += 1
+                    interval_processed += 1
+                else:
+                    latency = time.time() - key[1] / 1e9
+                    print(f"Processed {rel} ({latency:.2f}s after last write)")
+                    latencies.append(latency)
+                    processed += 1
+                    interval_processed += 1
+                # Remember failures too, so a bad file isn't retried until it changes
+                done[rel] = key
+
+            now = time.monotonic()
+            if now >= next_stats:
+                summary = _percentiles(latencies)
+                latency_text = (f"latency p50 {summary['p50']:.2f}s p90 {summary['p90']:.2f}s max {summary['max']:.2f}s"
+                                if latencies else "no new writes")
+                print(f"[watch] {interval_processed / stats_interval:.2f} files/s over the last {stats_interval:g}s, {latency_text}; "
+                      f"{processed} processed, {failed} failed, {len(pending) + len(running)} pending in total")
+                interval_processed = 0
+                latencies = []
+                next_stats = now + stats_interval
+    except KeyboardInterrupt:
+        print("\nStopping watch...")
+    finally:
+        watcher.close()
+        pool.shutdown(wait=False, cancel_futures=True)
+    elapsed = time.monotonic() - started
+    print(f"Watched for {elapsed:.0f}s: {processed} processed, {failed} failed.")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Resize images in a directory to specified dimensions and convert to a specified format.")
     parser.add_argument("dir_path", nargs="?", type=str, help="The path to the directory containing images to resize.")
@@ -344,8 +2757,82 @@ if __name__ == "__main__":
                         help="Padding color for --box_mode contain/clip when image is smaller. Use 'transparent' for alpha-capable outputs.")
     parser.add_argument("--target_ext", type=str, help="The target file extension for the resized images (e.g., .jpg, .png, .webp, or .avif).", default=".jpg")
     parser.add_argument("--rename", action="store_true", help="Rename output files to folder_name (1), folder_name (2), etc. instead of preserving original names.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of images to process in parallel. 1 (default) processes files one at a time.")
+    parser.add_argument("--executor", choices=["process", "thread"], default="process",
+                        help="Pool type used when --workers > 1: process (default, best for CPU-bound work) or thread.")
+    parser.add_argument("--progress_order", choices=["input", "completion"], default="input",
+                        help="Print progress in input order (default) or as soon as each file finishes.")
+    parser.add_argument("--fast_decode", action="store_true",
+                        help="For large downscales, decode at reduced resolution (JPEG draft / reduce) before the final LANCZOS resample.")
+    parser.add_argument("--reducing_gap", type=float, default=2.0,
+                        help="With --fast_decode, keep at least this many times the target size before the final resample (at least 1). Higher is slower but closer to a full decode (default: 2.0).")
+    parser.add_argument("--quality", type=int, default=None,
+                        help="Encoder quality for .jpg/.webp/.avif/.heic output (encoder default if omitted).")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"Keep a manifest ({MANIFEST_FILENAME}) in the output directory and skip inputs unchanged since the last run. Also resumes a crashed run.")
+    parser.add_argument("--hash", action="store_true",
+                        help="With --incremental, also record a SHA-256 of each input so touched-but-identical files are skipped.")
+    parser.add_argument("--sizes", nargs="+", type=int, metavar="SIZE", default=None,
+                        help="Size ladder: write one output per SIZE (used as --max_dimension) into <output_dir>/<SIZE>/, decoding each source once.")
+    parser.add_argument("--formats", nargs="+", metavar="EXT", default=None,
+                        help="With --sizes, write every size in each of these extensions (default: --target_ext).")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Overlap reading, transforming and writing: prefetch inputs, transform in memory on --workers, and write from a dedicated writer. Best on network shares.")
+    parser.add_argument("--readers", type=int, default=2,
+                        help="With --pipeline, number of threads prefetching input files (default: 2).")
+    parser.add_argument("--read_ahead", type=int, default=8,
+                        help="With --pipeline, maximum number of input files held in memory ahead of the transform stage (default: 8).")
+    parser.add_argument("--write_queue", type=int, default=8,
+                        help="With --pipeline, maximum number of encoded results waiting for the writer (default: 8).")
+    parser.add_argument("--write_batch", type=int, default=16,
+                        help="With --pipeline, maximum number of results the writer stages as temp files and then renames into place together, with one folder sync per batch (default: 16).")
+    parser.add_argument("--copy_through", action="store_true",
+                        help="Copy inputs byte-for-byte instead of re-encoding when the header shows they already match the target format, size and orientation.")
+    parser.add_argument("--max_memory", type=int, default=None, metavar="MB",
+                        help="Memory budget in MB. Files are admitted only while their estimated decoded footprint fits; larger files run alone with a reduced decode.")
+    parser.add_argument("--dedupe", choices=["link", "alias"], default=None,
+                        help=f"Hash inputs and process each distinct content + parameter set once ({CONTENT_STORE_FILENAME}). "
+                             "Duplicates get a hardlink to the existing output (link) or only a manifest alias (alias, needs --incremental).")
+    parser.add_argument("--plan", action="store_true",
+                        help="Dry run: scan headers only and print each file's action and output size plus a summary, without writing anything.")
+    parser.add_argument("--shards", choices=["tar", "zip"], default=None,
+                        help="Write outputs into size-capped WebDataset-style tar or zip shards (with a JSON sidecar per image and an index per shard) instead of one file per image.")
+    parser.add_argument("--shard_size", type=int, default=1024, metavar="MB",
+                        help="With --shards, start a new shard once the current one reaches this size (default: 1024).")
+    parser.add_argument("--profile", type=str, default=None, metavar="REPORT.json",
+                        help="Time each file's stages (open, decode, exif_transpose, resize, fit, flip, save) and write per-file timings with per-stage and per-format percentiles as JSON.")
+    parser.add_argument("--profile_cprofile", type=str, default=None, metavar="STATS.prof",
+                        help="With --profile, also run cProfile on every file, dump the merged stats here and list the top functions in the report.")
+    parser.add_argument("--profile_tracemalloc", action="store_true",
+                        help="With --profile, record each file's peak traced Python allocation (Pillow pixel buffers are not traced).")
+    parser.add_argument("--file_timeout", type=float, default=None, metavar="SECONDS",
+                        help=f"Run each file in a killable worker and quarantine files that take longer than this ({QUARANTINE_FILENAME}); later runs skip them.")
+    parser.add_argument("--file_memory", type=int, default=None, metavar="MB",
+                        help="Like --file_timeout, but let each worker map at most this many MB of address space beyond its idle footprint (Unix) and quarantine files that exceed it. "
+                             "Address space counts allocator and thread reservations, not just decoded pixels, so allow a few hundred MB.")
+    parser.add_argument("--retry_quarantined", action="store_true",
+                        help="Process quarantined files again instead of skipping them.")
+    parser.add_argument("--optimize", action="store_true",
+                        help="After resizing, losslessly shrink PNG/WebP outputs (palette/bit-depth/grayscale reduction, zlib level and strategy; lossless WebP) on --workers and report the bytes saved.")
+    parser.add_argument("--optimize_budget", type=float, default=2.0, metavar="SECONDS",
+                        help="With --optimize, CPU seconds to spend trying encodings per file; the smallest found so far is kept (default: 2.0).")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and resize new or changed images anywhere under dir_path as they are written (outputs mirror subfolders). Stop with Ctrl+C.")
+    parser.add_argument("--watch_backend", choices=["auto", "inotify", "poll"], default="auto",
+                        help="With --watch, how changes are detected: inotify (Linux, needs inotify_simple), scandir polling, or auto (default).")
+    parser.add_argument("--debounce", type=float, default=1.0, metavar="SECONDS",
+                        help="With --watch, process a file only once its size and mtime have been stable this long (default: 1.0).")
+    parser.add_argument("--poll_interval", type=float, default=1.0, metavar="SECONDS",
+                        help="With --watch and polling, seconds between directory scans (default: 1.0).")
+    parser.add_argument("--stats_interval", type=float, default=60.0, metavar="SECONDS",
+                        help="With --watch, print throughput and latency stats this often (default: 60).")
     parser.add_argument("--flip_horizontal", action="store_true", help="Flip images horizontally.")
     parser.add_argument("--flip_vertical", action="store_true", help="Flip images vertically.")
+    parser.add_argument("--chain", action="store_true",
+                        help="Apply --flip_horizontal/--flip_vertical inside the resize pass (one decode/encode per image) instead of running flip only.")
+    parser.add_argument("--emit_original", action="store_true",
+                        help="With --chain, write both the unflipped output and the flipped one (suffixed _fliph/_flipv/_fliphv). Implies --chain.")
 
     args = parser.parse_args()
 
@@ -366,7 +2853,63 @@ if __name__ == "__main__":
     if args.output_dir is None:
         args.output_dir = os.path.join(args.dir_path, "resized-images-resize-py")
 
-    if args.flip_horizontal or args.flip_vertical:
+    if args.emit_original and not (args.flip_horizontal or args.flip_vertical):
+        parser.error("--emit_original requires --flip_horizontal and/or --flip_vertical")
+    if args.reducing_gap < 1:
+        # Below 1 the reduced decode is smaller than the target and gets upscaled
+        parser.error("--reducing_gap must be at least 1")
+
+    if args.watch:
+        # Batch-only options; watch mode would otherwise silently ignore them
+        batch_only = {
+            "--rename": args.rename,
+            "--incremental": args.incremental,
+            "--hash": args.hash,
+            "--pipeline": args.pipeline,
+            "--max_memory": args.max_memory,
+            "--dedupe": args.dedupe,
+            "--plan": args.plan,
+            "--shards": args.shards,
+            "--profile": args.profile,
+            "--profile_cprofile": args.profile_cprofile,
+            "--profile_tracemalloc": args.profile_tracemalloc,
+            "--file_timeout": args.file_timeout,
+            "--file_memory": args.file_memory,
+            "--retry_quarantined": args.retry_quarantined,
+            "--optimize": args.optimize,
+        }
+        rejected = [flag for flag, value in batch_only.items() if value]
+        if rejected:
+            parser.error(f"--watch cannot be combined with {', '.join(rejected)}")
+        if args.target_ext not in TARGET_FORMATS:
+            parser.error(f"Unsupported --target_ext '{args.target_ext}'. Use: {', '.join(TARGET_FORMATS)}")
+        if args.sizes:
+            unsupported = [ext for ext in args.formats or () if ext not in TARGET_FORMATS]
+            if unsupported:
+                parser.error(f"Unsupported --formats {', '.join(unsupported)}. Use: {', '.join(TARGET_FORMATS)}")
+            if args.box:
+                parser.error("--sizes cannot be combined with --box")
+        watch_options = _make_options(
+            min_dimension=args.min_dimension,
+            max_dimension=args.max_dimension,
+            target_ext=args.target_ext,
+            box=tuple(args.box) if args.box else None,
+            box_mode=args.box_mode,
+            pad_color=args.pad_color,
+            fast_decode=args.fast_decode,
+            reducing_gap=args.reducing_gap,
+            quality=args.quality,
+            sizes=args.sizes,
+            formats=(args.formats or [args.target_ext]) if args.sizes else None,
+            copy_through=args.copy_through,
+            flip_horizontal=args.flip_horizontal,
+            flip_vertical=args.flip_vertical,
+            emit_original=args.emit_original,
+        )
+        watch_images(args.dir_path, args.output_dir, watch_options, workers=args.workers, executor=args.executor,
+                     debounce=args.debounce, poll_interval=args.poll_interval, stats_interval=args.stats_interval,
+                     backend=args.watch_backend)
+    elif (args.flip_horizontal or args.flip_vertical) and not (args.chain or args.emit_original):
         flip_images(args.dir_path, args.output_dir, args.flip_horizontal, args.flip_vertical)
     else:
         resize_images(
@@ -379,4 +2922,36 @@ if __name__ == "__main__":
             box=tuple(args.box) if args.box else None,
             box_mode=args.box_mode,
             pad_color=args.pad_color,
+            workers=args.workers,
+            executor=args.executor,
+            progress_order=args.progress_order,
+            fast_decode=args.fast_decode,
+            reducing_gap=args.reducing_gap,
+            quality=args.quality,
+            incremental=args.incremental,
+            content_hash=args.hash,
+            sizes=args.sizes,
+            formats=args.formats,
+            pipeline=args.pipeline,
+            readers=args.readers,
+            read_ahead=args.read_ahead,
+            write_queue=args.write_queue,
+            write_batch=args.write_batch,
+            copy_through=args.copy_through,
+            flip_horizontal=args.flip_horizontal,
+            flip_vertical=args.flip_vertical,
+            emit_original=args.emit_original,
+            max_memory=args.max_memory * 1024 * 1024 if args.max_memory else None,
+            dedupe=args.dedupe,
+            plan=args.plan,
+            shards=args.shards,
+            shard_size=args.shard_size * 1024 * 1024,
+            profile=args.profile,
+            profile_cprofile=args.profile_cprofile,
+            profile_tracemalloc=args.profile_tracemalloc,
+            file_timeout=args.file_timeout,
+            file_memory=args.file_memory * 1024 * 1024 if args.file_memory else None,
+            retry_quarantined=args.retry_quarantined,
+            optimize=args.optimize,
+            optimize_budget=args.optimize_budget,
         )
\ No newline at end of file
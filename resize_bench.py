@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import resize
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BOX_MODES = ["minmax", "clip", "cover", "contain"]
+TARGET_EXTS = list(resize.TARGET_FORMATS)
+
+# (label, width, height) of the synthetic sources; a mix of small, typical and camera-sized
+CORPUS_SIZES = [
+    ("small", 640, 480),
+    ("portrait", 832, 1216),
+    ("square", 2048, 2048),
+    ("camera", 6000, 4000),
+]
+
+EXAMPLES_TEXT = """\
+Examples
+
+  1) Run every box mode x target format on the default corpus and save results
+      python resize_bench.py --output bench.json
+
+  2) Only the JPEG/PNG encoders for cover and contain, best of 5 runs
+      python resize_bench.py --box_modes cover contain --formats .jpg .png --repeat 5 --output bench.json
+
+  3) Compare two runs (e.g. before/after a change or a Pillow upgrade)
+      python resize_bench.py --compare before.json after.json
+"""
+
+
+def _synthetic_image(rng, width, height, mode):
+    """Build a deterministic image with gradients and noise so encoders have real work to do."""
+    Image = resize._require_pillow()[0]
+    gradient = Image.linear_gradient("L").resize((width, height))
+    # Generate noise at a quarter of the size; camera-sized effect_noise is slow
+    noise = Image.effect_noise((max(1, width // 4), max(1, height // 4)), rng.uniform(20, 60)).resize((width, height))
+    rotated = Image.radial_gradient("L").resize((width, height))
+    img = Image.merge("RGB", (gradient, noise, rotated))
+
+    if mode == "RGBA":
+        alpha = Image.radial_gradient("L").resize((width, height))
+        img.putalpha(alpha)
+    elif mode == "P":
+        img = img.quantize(colors=rng.choice([16, 64, 256]), method=Image.Quantize.FASTOCTREE)
+        img.info["transparency"] = 0
+    return img
+
+
+def build_corpus(corpus_dir, copies=2, seed=0):
+    """Write the synthetic benchmark corpus into corpus_dir and return the file names.
+
+    For every size in CORPUS_SIZES there is an RGB JPEG, an EXIF-rotated JPEG,
+    an RGBA PNG and a palette PNG with transparency.
+    """
+    Image = resize._require_pillow()[0]
+    os.makedirs(corpus_dir, exist_ok=True)
+    rng = random.Random(seed)
+    names = []
+    for copy in range(copies):
+        for label, width, height in CORPUS_SIZES:
+            stem = f"{label}-{copy}"
+
+            img = _synthetic_image(rng, width, height, "RGB")
+            img.save(os.path.join(corpus_dir, stem + "-rgb.jpg"), "JPEG", quality=92)
+            names.append(stem + "-rgb.jpg")
+
+            exif = Image.Exif()
+            exif[resize.EXIF_ORIENTATION_TAG] = rng.choice([3, 6, 8])
+            img.save(os.path.join(corpus_dir, stem + "-exif.jpg"), "JPEG", quality=92, exif=exif)
+            names.append(stem + "-exif.jpg")
+
+            _synthetic_image(rng, width, height, "RGBA").save(os.path.join(corpus_dir, stem + "-alpha.png"), "PNG")
+            names.append(stem + "-alpha.png")
+
+            _synthetic_image(rng, width, height, "P").save(os.path.join(corpus_dir, stem + "-palette.png"), "PNG")
+            names.append(stem + "-palette.png")
+    return names
+
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _run_case(corpus_dir, names, output_dir, options):
+    """Process the corpus once with options. Runs in a fresh process so peak RSS is per case."""
+    os.makedirs(output_dir, exist_ok=True)
+    output_bytes = 0
+    start = time.perf_counter()
+    for name in names:
+        output_path = os.path.join(output_dir, os.path.splitext(name)[0] + options["target_ext"])
+        for path in resize._process_file(os.path.join(corpus_dir, name), output_path, options):
+            output_bytes += os.path.getsize(path)
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "output_bytes": output_bytes, "peak_rss_kb": _peak_rss_kb()}
+
+
+def _available_exts(exts):
+    """Drop target formats whose encoder plugin isn't installed."""
+    Image = resize._require_pillow()[0]
+    Image.init()
+    return [ext for ext in exts if resize.TARGET_FORMATS[ext] in Image.SAVE]
+
+
+def run_benchmarks(box_modes=None, target_exts=None, box=(512, 512), max_dimension=1024, copies=2, repeat=3, seed=0,
+                   fast_decode=False, corpus_dir=None):
+    """Run every box_mode x target format case and return a JSON-serializable result dict."""
+    Image = resize._require_pillow()[0]
+    box_modes = box_modes or BOX_MODES
+    target_exts = _available_exts(target_exts or TARGET_EXTS)
+
+    workdir = tempfile.mkdtemp(prefix="resize-bench-")
+    try:
+        corpus_dir = corpus_dir or os.path.join(workdir, "corpus")
+        print(f"Building synthetic corpus in {corpus_dir}...")
+        # Case processes inherit this process's ru_maxrss high-water mark, so the
+        # corpus is built in its own process to keep that mark at import size
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            names = pool.submit(build_corpus, corpus_dir, copies=copies, seed=seed).result()
+        print(f"Corpus has {len(names)} images.")
+
+        cases = []
+        # A fresh single-worker process per run keeps peak RSS from leaking between cases
+        for box_mode in box_modes:
+            for target_ext in target_exts:
+                options = resize._make_options(
+                    target_ext=target_ext,
+                    max_dimension=max_dimension,
+                    box=None if box_mode == "minmax" else tuple(box),
+                    box_mode="clip" if box_mode == "minmax" else box_mode,
+                    fast_decode=fast_decode,
+                )
+                runs = []
+                for attempt in range(repeat):
+                    output_dir = os.path.join(workdir, f"out-{box_mode}-{target_ext[1:]}-{attempt}")
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                        runs.append(pool.submit(_run_case, corpus_dir, names, output_dir, options).result())
+                    shutil.rmtree(output_dir, ignore_errors=True)
+
+                best = min(runs, key=lambda run: run["seconds"])
+                case = {
+                    "name": f"{box_mode}{target_ext}",
+                    "box_mode": box_mode,
+                    "target_ext": target_ext,
+                    "images": len(names),
+                    "seconds": round(best["seconds"], 4),
+                    "images_per_sec": round(len(names) / best["seconds"], 3),
+                    "peak_rss_kb": max((run["peak_rss_kb"] or 0) for run in runs) or None,
+                    "output_bytes": best["output_bytes"],
+                }
+                cases.append(case)
+                print(f"{case['name']:<16} {case['images_per_sec']:>9.2f} img/s  "
+                      f"{case['peak_rss_kb'] or 0:>9} KB peak  {case['output_bytes']:>11} bytes")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "pillow": Image.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "copies": copies,
+            "repeat": repeat,
+            "seed": seed,
+            "box": list(box),
+            "max_dimension": max_dimension,
+            "fast_decode": fast_decode,
+        },
+        "cases": cases,
+    }
+
+
+def compare_results(before, after):
+    """Print per-case changes between two result files. Positive img/s deltas are speedups."""
+    before_cases = {case["name"]: case for case in before["cases"]}
+    print(f"{'case':<16} {'img/s':>18} {'peak RSS KB':>22} {'output bytes':>26}")
+    for case in after["cases"]:
+        old = before_cases.get(case["name"])
+        if old is None:
+            print(f"{case['name']:<16} (new case)")
+            continue
+        print(f"{case['name']:<16} "
+              f"{_format_delta(old['images_per_sec'], case['images_per_sec']):>18} "
+              f"{_format_delta(old['peak_rss_kb'], case['peak_rss_kb']):>22} "
+              f"{_format_delta(old['output_bytes'], case['output_bytes']):>26}")
+
+
+def _format_delta(old, new):
+    if not old or new is None:
+        return f"{new}"
+    return f"{new} ({(new - old) / old * 100:+.1f}%)"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark resize.py transforms and encoders on a synthetic corpus.")
+    parser.add_argument("--examples", action="store_true", help="Print usage examples and exit.")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this file.")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), default=None,
+                        help="Compare two result files instead of running benchmarks.")
+    parser.add_argument("--box_modes", nargs="+", choices=BOX_MODES, default=None,
+                        help="Transforms to benchmark; 'minmax' is the --min/--max_dimension path (default: all).")
+    parser.add_argument("--formats", nargs="+", choices=TARGET_EXTS, default=None,
+                        help="Target formats to benchmark (default: all with an installed encoder).")
+    parser.add_argument("--box", nargs=2, type=int, metavar=("WIDTH", "HEIGHT"), default=[512, 512],
+                        help="Box used for clip/cover/contain cases (default: 512 512).")
+    parser.add_argument("--max_dimension", type=int, default=1024, help="--max_dimension for the minmax case (default: 1024).")
+    parser.add_argument("--copies", type=int, default=2, help="Copies of each synthetic image kind (default: 2).")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the fastest is reported (default: 3).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic corpus (default: 0).")
+    parser.add_argument("--fast_decode", action="store_true", help="Benchmark with resize.py --fast_decode enabled.")
+    parser.add_argument("--corpus_dir", type=str, default=None, help="Build the corpus here instead of a temp directory.")
+
+    args = parser.parse_args()
+
+    if args.examples:
+        print(EXAMPLES_TEXT)
+        raise SystemExit(0)
+
+    if args.compare:
+        with open(args.compare[0], "r") as f:
+            before = json.load(f)
+        with open(args.compare[1], "r") as f:
+            after = json.load(f)
+        compare_results(before, after)
+        raise SystemExit(0)
+
+    results = run_benchmarks(
+        box_modes=args.box_modes,
+        target_exts=args.formats,
+        box=args.box,
+        max_dimension=args.max_dimension,
+        copies=args.copies,
+        repeat=args.repeat,
+        seed=args.seed,
+        fast_decode=args.fast_decode,
+        corpus_dir=args.corpus_dir,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Results written to {args.output}")
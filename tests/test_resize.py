@@ -0,0 +1,51 @@
+import collections
+import glob
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import resize  # noqa: E402
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _make_inputs(path, count):
+    path.mkdir()
+    for i in range(count):
+        Image.new("RGB", (64, 48), (i * 7 % 256, 80, 160)).save(path / f"img{i:03d}.png")
+
+
+def test_shard_rerun_rewrites_each_shard_at_most_once(tmp_path, monkeypatch):
+    inputs, output = tmp_path / "in", tmp_path / "out"
+    _make_inputs(inputs, 30)
+    output.mkdir()
+    options = dict(min_dimension=None, max_dimension=32, target_ext=".png", shards="tar", shard_size=4096)
+    resize.resize_images(str(inputs), str(output), **options)
+    assert len(glob.glob(str(output / "shard-*.index.json"))) > 1
+
+    rewrites = collections.Counter()
+    remove_samples = resize._ShardWriter._remove_samples
+
+    def counting(self, number, keys):
+        rewrites[number] += 1
+        return remove_samples(self, number, keys)
+
+    monkeypatch.setattr(resize._ShardWriter, "_remove_samples", counting)
+    resize.resize_images(str(inputs), str(output), **options)
+
+    assert rewrites and max(rewrites.values()) == 1
+    keys = collections.Counter()
+    for index_path in glob.glob(str(output / "shard-*.index.json")):
+        with open(index_path, encoding="utf-8") as f:
+            keys.update(json.load(f)["samples"].keys())
+    assert len(keys) == 30 and set(keys.values()) == {1}
+
+
+
+def test_resize_job_max_dimension_only():
+    options = resize.ResizeJob(max_dimension=512).options()
+    assert options["min_dimension"] is None and options["max_dimension"] == 512